@@ -3,29 +3,47 @@
 import os
 import sys
 import json
+import mmap
+import operator
+import re
+import functools
+import contextlib
+import gzip
+import hashlib
+import zlib
+import threading
+import itertools
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from textwrap import dedent
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, Set
 import shutil # For copying .ai_ignore_example
 
 # Third-party libraries
-import litellm
-from litellm import completion, acompletion # For async if we need it later
-from pydantic import BaseModel, ValidationError
-from dotenv import load_dotenv
+# litellm and prompt_toolkit are imported lazily (see _get_litellm / get_prompt_session):
+# litellm alone pulls in hundreds of modules and dominates startup time.
+# rich.markdown (markdown-it) and dotenv are likewise imported where they are used.
+from pydantic import AliasChoices, BaseModel, Field, TypeAdapter, ValidationError
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
-from rich.style import Style
-from rich.syntax import Syntax
-from rich.markdown import Markdown
+from rich.json import JSON
 from rich.prompt import Prompt, Confirm
-from prompt_toolkit import PromptSession
-from prompt_toolkit.styles import Style as PromptStyle
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 import time
 import uuid # For unique tool call IDs if needed
+try:
+    import orjson # Optional C JSON codec; stdlib json is used when it is not installed
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson else json.loads # orjson.JSONDecodeError subclasses json.JSONDecodeError
+
+def json_dumps(obj: Any, indent: bool = False) -> str:
+    """Serialize to a str with orjson when available (2-space indent if requested), else stdlib json."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None).decode("utf-8")
+    return json.dumps(obj, indent=2 if indent else None)
 
 # --- Configuration ---
 CONFIG_DIR = Path.home() / ".ai_code_assistant"
@@ -37,43 +55,97 @@ AI_IGNORE_EXAMPLE_FILE = CONFIG_DIR / ".ai_ignore_example"
 # Initialize Rich console
 console = Console()
 
-# Initialize prompt_toolkit session
-try:
-    prompt_session = PromptSession(
-        history=FileHistory(CONFIG_DIR / ".prompt_history"),
-        auto_suggest=AutoSuggestFromHistory(),
-        style=PromptStyle.from_dict({
-            'prompt': '#00aaff bold',  # Light blue prompt
-            'completion-menu.completion': 'bg:#1e3a8a fg:#ffffff',
-            'completion-menu.completion.current': 'bg:#3b82f6 fg:#ffffff bold',
-        })
-    )
-except Exception: # Fallback if FileHistory path is not writable initially
-    prompt_session = PromptSession(
-        style=PromptStyle.from_dict({
-            'prompt': '#00aaff bold',
-        })
-    )
+AUTO_SUGGEST_HISTORY_SIZE = 256 # Most recent prompts considered for inline suggestions
+
+@functools.lru_cache(maxsize=None)
+def get_prompt_session():
+    """Build the prompt_toolkit session on first use (only the interactive loop needs it)."""
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.styles import Style as PromptStyle
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.auto_suggest import AutoSuggest, Suggestion
+
+    class RecentFileHistory(FileHistory):
+        """FileHistory that also keeps the newest entries in a bounded deque (newest first)."""
+        def __init__(self, filename):
+            self.recent_strings = deque(maxlen=AUTO_SUGGEST_HISTORY_SIZE)
+            super().__init__(filename)
+
+        def load_history_strings(self):
+            for string in super().load_history_strings(): # Yielded newest first
+                if len(self.recent_strings) < AUTO_SUGGEST_HISTORY_SIZE:
+                    self.recent_strings.append(string)
+                yield string
+
+        def append_string(self, string):
+            super().append_string(string)
+            self.recent_strings.appendleft(string)
+
+    class RecentHistoryAutoSuggest(AutoSuggest):
+        """
+        Same suggestions as AutoSuggestFromHistory, but searched over the bounded recent deque.
+        AutoSuggestFromHistory copies the entire history into a new list on every keystroke.
+        """
+        def get_suggestion(self, buffer, document):
+            # Consider only the last line for the suggestion.
+            text = document.text.rsplit("\n", 1)[-1]
+            if text.strip():
+                # Snapshot: the history loader thread may still be filling the deque
+                for string in tuple(buffer.history.recent_strings):
+                    for line in reversed(string.splitlines()):
+                        if line.startswith(text):
+                            return Suggestion(line[len(text):])
+            return None
+
+    try:
+        return PromptSession(
+            history=RecentFileHistory(CONFIG_DIR / ".prompt_history"),
+            auto_suggest=RecentHistoryAutoSuggest(),
+            style=PromptStyle.from_dict({
+                'prompt': '#00aaff bold',  # Light blue prompt
+                'completion-menu.completion': 'bg:#1e3a8a fg:#ffffff',
+                'completion-menu.completion.current': 'bg:#3b82f6 fg:#ffffff bold',
+            })
+        )
+    except Exception: # Fallback if FileHistory path is not writable initially
+        return PromptSession(
+            style=PromptStyle.from_dict({
+                'prompt': '#00aaff bold',
+            })
+        )
+
+@functools.lru_cache(maxsize=None)
+def _get_litellm():
+    """Import LiteLLM on first LLM call rather than at startup."""
+    import litellm
+    return litellm
 
 
 # --- Global State & Configuration Variables ---
 conversation_history: List[Dict[str, Any]] = []
+file_context_index: Dict[str, Dict[str, Any]] = {} # path -> its file_context message in conversation_history; O(1) "already in context" checks
 current_llm_model: str = "gpt-4.1" # Default model
 current_workspace_root: Optional[Path] = None
+session_cwd: str = os.getcwd() # The assistant never chdirs, so the CWD is captured once instead of queried per path
 # litellm.set_verbose = True # For debugging LiteLLM calls
 
 # --------------------------------------------------------------------------------
 # 1. Pydantic Schemas (no changes needed from original for these)
 # --------------------------------------------------------------------------------
+# The create_file/edit_file tool schemas name the path 'file_path'; create_multiple_files entries use 'path'
+PATH_FIELD = Field(validation_alias=AliasChoices("path", "file_path"))
+
 class FileToCreate(BaseModel):
-    path: str
+    path: str = PATH_FIELD
     content: str
 
 class FileToEdit(BaseModel):
-    path: str
+    path: str = PATH_FIELD
     original_snippet: str # This should be the exact snippet the LLM intends to replace
     new_snippet: str
 
+FILES_TO_CREATE_ADAPTER = TypeAdapter(List[FileToCreate]) # Built once; validates a whole files array in one pydantic-core call
+
 # --------------------------------------------------------------------------------
 # 2. Function Calling Tool Definitions
 # --------------------------------------------------------------------------------
@@ -251,7 +323,28 @@ SYSTEM_PROMPT_TEMPLATE = dedent("""\
 def get_system_prompt() -> str:
     global current_llm_model, current_workspace_root
     workspace_info = str(current_workspace_root) if current_workspace_root else "Not set. Paths will be resolved from the current working directory or absolute paths."
-    return SYSTEM_PROMPT_TEMPLATE.format(model_name=current_llm_model, workspace_root_info=workspace_info)
+    return _render_system_prompt(current_llm_model, workspace_info)
+
+@functools.lru_cache(maxsize=16)
+def _render_system_prompt(model_name: str, workspace_root_info: str) -> str:
+    # Same inputs return the same str object, keeping the prompt prefix byte-identical across turns
+    return SYSTEM_PROMPT_TEMPLATE.format(model_name=model_name, workspace_root_info=workspace_root_info)
+
+def supports_prompt_caching(model_name: str) -> bool:
+    """Anthropic models (direct, Bedrock, Vertex, ...) need explicit cache_control breakpoints for prompt caching."""
+    return "claude" in model_name.lower() or model_name.startswith("anthropic/")
+
+def system_message_for_api(model_name: str) -> Dict[str, Any]:
+    """
+    Build the system message sent to the LLM.
+    For providers with explicit prompt caching the prompt is marked as an ephemeral cache breakpoint.
+    Tools precede the system prompt in the cached prefix, so this one marker caches both.
+    Other providers (e.g. OpenAI) cache long stable prefixes automatically and get a plain string.
+    """
+    prompt = get_system_prompt()
+    if supports_prompt_caching(model_name):
+        return {"role": "system", "content": [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]}
+    return {"role": "system", "content": prompt}
 
 # --------------------------------------------------------------------------------
 # 4. Configuration Management (New Feature)
@@ -275,8 +368,8 @@ DEFAULT_CONFIG = {
     "max_tokens_context": 120000, # Approximate context window, LiteLLM handles specifics
 }
 
-def ensure_config_defaults(config: Dict) -> Dict:
-    """Ensure all default keys exist in the loaded config."""
+def ensure_config_defaults(config: Dict) -> Tuple[Dict, bool]:
+    """Ensure all default keys exist in the loaded config. Returns (config, updated)."""
     updated = False
     for key, value in DEFAULT_CONFIG.items():
         if key not in config:
@@ -298,11 +391,41 @@ def ensure_config_defaults(config: Dict) -> Dict:
     if "max_tokens_context" not in config:
         config["max_tokens_context"] = DEFAULT_CONFIG["max_tokens_context"]
         updated = True
-    return config
+    return config, updated
 
 
+def _file_mtime_ns(file_path: Path) -> Optional[int]:
+    """mtime of file_path, or None if it does not exist (one stat instead of exists() + stat())."""
+    try:
+        return file_path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+def write_file_atomic(file_path: Path, data: bytes):
+    """Replace file_path with data in one buffered write; a crash leaves either the old or the new file, never a torn one."""
+    tmp_path = file_path.with_name(file_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno()) # Data must be on disk before the rename makes it visible
+    os.replace(tmp_path, file_path)
+
+_config_file_mtime_ns: Optional[int] = None # mtime of CONFIG_FILE as last read or written by us; anything else is an external edit
+_config_file_text: Optional[str] = None # Serialized config as last read or written by us; save_config skips identical writes
+
 def load_config() -> Dict:
-    global current_llm_model, current_workspace_root
+    """Read the config file and apply its current profile."""
+    config_data = _read_config_file()
+    _apply_profile(config_data, config_data.get("current_profile", "default"))
+    return config_data
+
+def config_file_changed_externally() -> bool:
+    """True if CONFIG_FILE was modified since this process last read or wrote it."""
+    return _file_mtime_ns(CONFIG_FILE) != _config_file_mtime_ns
+
+def _read_config_file() -> Dict:
+    """Load CONFIG_FILE (creating or repairing it as needed) without applying any profile."""
+    global _config_file_mtime_ns, _config_file_text
     CONFIG_DIR.mkdir(parents=True, exist_ok=True)
     SESSION_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -332,23 +455,30 @@ def load_config() -> Dict:
 
     if CONFIG_FILE.exists():
         try:
-            with open(CONFIG_FILE, "r") as f:
-                config_data = json.load(f)
-            config_data = ensure_config_defaults(config_data) # Ensure all keys are present
+            with open(CONFIG_FILE, "rb") as f:
+                raw_config = f.read()
+            config_data = json_loads(raw_config)
+            config_data, config_dirty = ensure_config_defaults(config_data) # Ensure all keys are present
         except json.JSONDecodeError:
             console.print(f"[yellow]Warning: config.json is corrupted. Loading defaults.[/yellow]")
-            config_data = DEFAULT_CONFIG.copy()
+            config_data, config_dirty = DEFAULT_CONFIG.copy(), True
         except Exception as e:
             console.print(f"[red]Error loading config: {e}. Loading defaults.[/red]")
-            config_data = DEFAULT_CONFIG.copy()
+            config_data, config_dirty = DEFAULT_CONFIG.copy(), True
     else:
         console.print(f"Config file not found at [cyan]{CONFIG_FILE}[/cyan]. Creating with defaults.", style="blue")
-        config_data = DEFAULT_CONFIG.copy()
+        config_data, config_dirty = DEFAULT_CONFIG.copy(), True
 
-    save_config(config_data) # Save to ensure it's written if created or updated
+    if config_dirty: # Only write when the file was created, repaired or gained missing defaults
+        save_config(config_data)
+    else:
+        _config_file_mtime_ns = _file_mtime_ns(CONFIG_FILE)
+        _config_file_text = json_dumps(config_data, indent=True)
+    return config_data
 
-    # Apply current profile settings
-    profile_name = config_data.get("current_profile", "default")
+def _apply_profile(config_data: Dict, profile_name: str):
+    """Set the model and workspace globals from a profile and auto-add its paths."""
+    global current_llm_model, current_workspace_root
     profile = config_data.get("profiles", {}).get(profile_name, DEFAULT_CONFIG["profiles"]["default"])
 
     current_llm_model = profile.get("model", config_data.get("default_model", "gpt-4.1"))
@@ -375,13 +505,17 @@ def load_config() -> Dict:
         for path_str in auto_add_paths:
             handle_add_command_logic(path_str, is_auto_add=True)
 
-    return config_data
-
 def save_config(config_data: Dict):
+    global _config_file_mtime_ns, _config_file_text
+    # Indented because users edit this file by hand (e.g. api_keys); one write instead of json.dump's per-chunk writes
+    config_text = json_dumps(config_data, indent=True)
+    if config_text == _config_file_text and not config_file_changed_externally():
+        return # e.g. /setmodel to the model already in use
     CONFIG_DIR.mkdir(parents=True, exist_ok=True)
     try:
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(config_data, f, indent=4)
+        write_file_atomic(CONFIG_FILE, config_text.encode("utf-8"))
+        _config_file_mtime_ns = _file_mtime_ns(CONFIG_FILE)
+        _config_file_text = config_text
     except Exception as e:
         console.print(f"[red]Error saving config: {e}[/red]")
 
@@ -395,55 +529,65 @@ config = load_config()
 def normalize_path_str(path_str: str) -> str:
     """Return a canonical, absolute version of the path string, resolved against workspace root if set."""
     global current_workspace_root
+    workspace_root_str = str(current_workspace_root) if current_workspace_root else None
+    return _normalize_cached(path_str, workspace_root_str, session_cwd)
 
+@functools.lru_cache(maxsize=4096)
+def _normalize_cached(path_str: str, workspace_root_str: Optional[str], cwd_str: str) -> str:
+    """Memoized body of normalize_path_str; everything the result depends on is part of the key."""
+    # Plain os.path string ops: no intermediate Path objects are built on the way to the final string.
     # Expand ~ to user's home directory
-    expanded_path = Path(path_str).expanduser()
+    expanded_path = os.path.expanduser(path_str)
 
-    if current_workspace_root:
-        # If path is already absolute, use it. Otherwise, join with workspace root.
-        resolved_path = current_workspace_root / expanded_path if not expanded_path.is_absolute() else expanded_path
-    else:
-        # If no workspace root, resolve relative to CWD or use absolute path
-        resolved_path = Path.cwd() / expanded_path if not expanded_path.is_absolute() else expanded_path
+    if not os.path.isabs(expanded_path):
+        # Relative paths are joined with the workspace root if set, otherwise with the CWD
+        expanded_path = os.path.join(workspace_root_str or cwd_str, expanded_path)
 
     try:
-        # .resolve(strict=False) handles non-existent paths for creation, but strict=True ensures it exists for reading/editing
-        # For our purpose, we often deal with paths that might be created, so strict=False is okay for normalization.
-        # However, actual file operations should handle FileNotFoundError.
-        final_path = resolved_path.resolve(strict=False)
+        # Non-strict resolution (same as Path.resolve(strict=False)) so paths that are about to be created still normalize.
+        # Actual file operations should handle FileNotFoundError.
+        final_path = os.path.realpath(expanded_path)
     except Exception as e: # Catch potential errors during resolution (e.g. permission issues)
-        console.print(f"[yellow]Warning: Could not fully resolve path '{path_str}': {e}. Using as is: {resolved_path}[/yellow]")
-        final_path = resolved_path # Fallback to non-strictly resolved
-
-    # Security check: prevent escaping the workspace root if one is set
-    if current_workspace_root:
-        try:
-            final_path.relative_to(current_workspace_root)
-        except ValueError:
-            # Path is outside the workspace root. This could be intentional for absolute paths.
-            # For now, we allow it but one might want to restrict this.
-            pass # Allow absolute paths or paths outside if explicitly given
+        console.print(f"[yellow]Warning: Could not fully resolve path '{path_str}': {e}. Using as is: {expanded_path}[/yellow]")
+        final_path = os.path.normpath(expanded_path) # Fallback to lexical normalization
 
-    if ".." in str(final_path): # A basic check, Path.resolve() should handle most traversals
-        # This check might be overly simplistic if ".." is part of a legitimate filename.
-        # Path.is_relative_to (Python 3.9+) is better if available and applicable.
-        pass
+    # Paths outside the workspace root are allowed (e.g. absolute paths given explicitly).
+    # One might want to restrict this in the future.
+    return final_path
 
-    return str(final_path)
 
+MMAP_READ_THRESHOLD = 64 * 1024 # Files at least this large are decoded straight from an mmap
 
 def read_local_file(file_path_str: str) -> str:
-    normalized_path = normalize_path_str(file_path_str)
+    return _read_local_file_normalized(normalize_path_str(file_path_str))
+
+def _read_local_file_normalized(normalized_path: str) -> str:
     try:
-        with open(normalized_path, "r", encoding="utf-8") as f:
-            return f.read()
+        fd = os.open(normalized_path, os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size < MMAP_READ_THRESHOLD:
+                with open(fd, "r", encoding="utf-8", closefd=False) as f:
+                    return f.read()
+            # Large file: decode directly from the mapped pages instead of copying into a bytes buffer first
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise"): # Linux/macOS only
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                content = str(mm, "utf-8")
+            if "\r" in content: # Match text-mode universal newline handling of the small-file path
+                content = content.replace("\r\n", "\n").replace("\r", "\n")
+            return content
+        finally:
+            os.close(fd)
     except FileNotFoundError:
         raise FileNotFoundError(f"File not found: {normalized_path}")
     except Exception as e:
         raise OSError(f"Error reading file {normalized_path}: {e}")
 
 def create_local_file(path_str: str, content: str):
-    file_path = Path(normalize_path_str(path_str))
+    _create_local_file_normalized(normalize_path_str(path_str), content)
+
+def _create_local_file_normalized(normalized_path: str, content: str):
+    file_path = Path(normalized_path)
 
     # Basic security: prevent writing to very high-level system dirs (very basic check)
     # A more robust check would involve allowlists or more sophisticated sandboxing.
@@ -456,17 +600,24 @@ def create_local_file(path_str: str, content: str):
         raise ValueError("File content exceeds 10MB size limit.")
 
     file_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write(content)
+    # Encode once and hand the bytes straight to the fd, skipping TextIOWrapper's chunked encode/buffering
+    data = memoryview(content.encode("utf-8"))
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        while data: # os.write may write less than requested
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
     console.print(f"[bold green]✓[/bold green] Created/updated file: '[bright_cyan]{file_path}[/bright_cyan]'")
 
-def apply_local_diff_edit(path_str: str, original_snippet: str, new_snippet: str):
+def apply_local_diff_edit(path_str: str, original_snippet: str, new_snippet: str) -> Optional[str]:
+    """Replace the first occurrence of original_snippet. Returns the new file content, or None if nothing changed."""
     normalized_path = normalize_path_str(path_str)
     try:
-        content = read_local_file(normalized_path)
+        content = _read_local_file_normalized(normalized_path) # Already normalized; skip the second resolve
 
-        occurrences = content.count(original_snippet)
-        if occurrences == 0:
+        match_index = content.find(original_snippet)
+        if match_index == -1:
             console.print(f"[bold red]✗ Original snippet not found in '{normalized_path}'.[/bold red]")
             console.print("Expected snippet (verbatim):")
             console.print(Panel(original_snippet, title="Expected Snippet", border_style="red", expand=False))
@@ -474,22 +625,23 @@ def apply_local_diff_edit(path_str: str, original_snippet: str, new_snippet: str
             # console.print(Panel(content[:500] + "..." if len(content) > 500 else content, title="Actual Content (Preview)", border_style="yellow", expand=False))
             raise ValueError("Original snippet not found. File not changed.")
 
-        if occurrences > 1:
-            # For now, we'll just replace the first one as per str.replace behavior.
+        snippet_end = match_index + len(original_snippet)
+        # Only need to know whether a second match exists, not how many; find() stops at the first one
+        if content.find(original_snippet, snippet_end) != -1:
+            # For now, we'll just replace the first one.
             # A more advanced version could ask the user or use line numbers.
-            console.print(f"[yellow]⚠ Warning: Original snippet found {occurrences} times in '{normalized_path}'. Replacing the first one.[/yellow]")
+            console.print(f"[yellow]⚠ Warning: Original snippet found more than once in '{normalized_path}'. Replacing the first one.[/yellow]")
             # Could add interactive selection here in the future.
 
-        updated_content = content.replace(original_snippet, new_snippet, 1)
-
-        if updated_content == content: # No change made
-            console.print(f"[yellow]⚠ Snippet replacement resulted in no change to the file '{normalized_path}'. This might happen if the new_snippet is identical to original_snippet or if the snippet was not actually found by str.replace (should be caught by occurrences check).[/yellow]")
-            # This case should ideally be caught by `occurrences == 0` or if `original_snippet == new_snippet`.
-            # If it still happens, it's an anomaly.
+        if new_snippet == original_snippet: # Replacement would not change the file
+            console.print(f"[yellow]⚠ Snippet replacement resulted in no change to the file '{normalized_path}' (new_snippet is identical to original_snippet).[/yellow]")
             return # Do not rewrite if no change.
 
-        create_local_file(normalized_path, updated_content)
+        updated_content = content[:match_index] + new_snippet + content[snippet_end:]
+
+        _create_local_file_normalized(normalized_path, updated_content)
         console.print(f"[bold green]✓[/bold green] Applied edit to '[bright_cyan]{normalized_path}[/bright_cyan]'")
+        return updated_content
 
     except FileNotFoundError:
         console.print(f"[bold red]✗[/bold red] File not found for editing: '[bright_cyan]{normalized_path}[/bright_cyan]'")
@@ -501,82 +653,192 @@ def apply_local_diff_edit(path_str: str, original_snippet: str, new_snippet: str
         console.print(f"[bold red]✗[/bold red] Error applying edit to '{normalized_path}': {e}")
         raise
 
-def is_binary_file(file_path_str: str, peek_size: int = 1024) -> bool:
+BINARY_PEEK_SIZE = 1024
+_peek_local = threading.local() # Per-thread reusable peek buffer; directory scans classify files from a thread pool
+_PEEK_OPEN_FLAGS = os.O_RDONLY | getattr(os, "O_CLOEXEC", 0) | getattr(os, "O_BINARY", 0)
+
+def is_binary_file(file_path_str: str, peek_size: int = BINARY_PEEK_SIZE) -> bool:
+    return _is_binary_normalized(normalize_path_str(file_path_str), peek_size)
+
+@functools.lru_cache(maxsize=65536)
+def _is_binary_cached(normalized_path: str, mtime_ns: int, size: int) -> bool:
+    """_is_binary_normalized memoized per file version; a changed mtime or size is a new key, so re-scans only sniff changed files."""
+    return _is_binary_normalized(normalized_path)
+
+def _is_binary_normalized(normalized_path: str, peek_size: int = BINARY_PEEK_SIZE) -> bool:
+    """Binary check for an already-normalized path: peek at the first bytes and look for a NUL."""
+    if peek_size == BINARY_PEEK_SIZE:
+        buf = getattr(_peek_local, "buf", None)
+        if buf is None:
+            buf = _peek_local.buf = bytearray(BINARY_PEEK_SIZE)
+    else:
+        buf = bytearray(peek_size)
     try:
-        with open(normalize_path_str(file_path_str), 'rb') as f:
-            chunk = f.read(peek_size)
-        return b'\0' in chunk
+        fd = os.open(normalized_path, _PEEK_OPEN_FLAGS)
+        try:
+            if not hasattr(os, "preadv"): # Windows: no vectored read, fall back to a plain read
+                return b'\0' in os.read(fd, peek_size)
+            n = os.preadv(fd, [buf], 0)
+        finally:
+            os.close(fd)
+        return buf.find(0, 0, n) != -1
     except Exception:
         return True # Treat as binary if error reading
 
 def get_ai_ignore_patterns(profile_custom_ignore_path: Optional[str]) -> List[str]:
     """Loads ignore patterns from global .ai_ignore and profile-specific one if provided."""
-    patterns = []
     # Default ignore file in CWD
     default_ignore = Path(DEFAULT_AI_IGNORE_FILE)
     # User-wide example/default ignore file
     user_wide_ignore = AI_IGNORE_EXAMPLE_FILE
 
-    files_to_check = []
-    if default_ignore.exists():
-        files_to_check.append(default_ignore)
-    elif user_wide_ignore.exists() and not profile_custom_ignore_path : # Use user-wide if no local and no profile specific
-        files_to_check.append(user_wide_ignore)
+    files_to_check = [] # (path, mtime_ns); the mtime makes an edited file a new key for the parse cache
+    default_mtime = _file_mtime_ns(default_ignore)
+    if default_mtime is not None:
+        files_to_check.append((str(default_ignore), default_mtime))
+    elif not profile_custom_ignore_path: # Use user-wide if no local and no profile specific
+        user_wide_mtime = _file_mtime_ns(user_wide_ignore)
+        if user_wide_mtime is not None:
+            files_to_check.append((str(user_wide_ignore), user_wide_mtime))
 
     if profile_custom_ignore_path:
         profile_ignore_path = Path(normalize_path_str(profile_custom_ignore_path))
-        if profile_ignore_path.exists():
-            files_to_check.append(profile_ignore_path)
+        profile_mtime = _file_mtime_ns(profile_ignore_path)
+        if profile_mtime is not None:
+            files_to_check.append((str(profile_ignore_path), profile_mtime))
         else:
             console.print(f"[yellow]Profile custom ignore file not found: {profile_ignore_path}[/yellow]", style="dim")
 
     if not files_to_check:
         console.print(f"No .ai_ignore file found in CWD, profile, or user config dir ([cyan]{user_wide_ignore}[/cyan]).", style="dim")
 
+    return list(_load_ignore_files(tuple(files_to_check)))
 
-    for file_path in files_to_check:
+@functools.lru_cache(maxsize=8)
+def _load_ignore_files(files_to_check: Tuple[Tuple[str, int], ...]) -> Tuple[str, ...]:
+    """Parse the given ignore files; cached, so repeated /add calls skip the read and parse until a file changes."""
+    patterns = []
+    for file_path, _mtime_ns in files_to_check:
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                for line in f:
-                    stripped_line = line.strip()
-                    if stripped_line and not stripped_line.startswith("#"):
-                        patterns.append(stripped_line)
+            ignore_text = Path(file_path).read_text(encoding="utf-8")
+            patterns.extend(line for line in map(str.strip, ignore_text.splitlines()) if line and line[0] != "#")
             console.print(f"Loaded ignore patterns from [cyan]{file_path}[/cyan]", style="dim")
         except Exception as e:
             console.print(f"[yellow]Warning: Could not read ignore file {file_path}: {e}[/yellow]", style="dim")
-    return list(set(patterns)) # Unique patterns
+    return tuple(dict.fromkeys(patterns)) # Unique patterns, first-seen order kept (stable key for the compiled matcher cache)
 
-def path_matches_ignore(path: Path, ignore_patterns: List[str], root_dir: Path) -> bool:
-    """Check if a path matches any ignore pattern. Basic implementation."""
-    # Ensure path is relative to the root_dir for pattern matching
-    try:
-        relative_path_str = str(path.relative_to(root_dir))
-    except ValueError: # path is not under root_dir, should not happen if called correctly
-        relative_path_str = str(path)
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a single path glob to regex; '*' and '?' never cross a '/'."""
+    return "".join("[^/]*" if c == "*" else "[^/]" if c == "?" else re.escape(c) for c in pattern)
+
+def _ignore_pattern_to_regex(pattern: str) -> str:
+    if pattern.endswith('/'):
+        return f"(?:.*/)?{_glob_to_regex(pattern.rstrip('/'))}/.*"
+    if '/' in pattern:
+        return _glob_to_regex(pattern)
+    return f"(?:.*/)?{_glob_to_regex(pattern)}/?"
 
+@functools.lru_cache(maxsize=32)
+def compile_ignore_patterns(ignore_patterns: Tuple[str, ...]) -> Callable[[str], bool]:
+    """
+    Fuse all ignore patterns into one regex matched against a workspace-relative POSIX path.
+    - 'name/'         matches anything beneath a directory called 'name', at any depth
+    - 'name', '*.ext' match the last path component (file or directory name)
+    - 'a/b.txt'       matches that exact relative path
+    - '!pattern'      re-includes paths the other patterns would ignore (a pruned directory stays pruned)
+    Directories can be tested by passing their relative path with a trailing '/'.
+    """
+    positive, negative = [], []
     for pattern in ignore_patterns:
-        # Simple matching:
-        # If pattern ends with /, it's a directory pattern
-        if pattern.endswith('/'):
-            dir_pattern = pattern.rstrip('/')
-            # Check if any part of the path matches the directory pattern
-            # e.g., pattern "node_modules/" should match "node_modules/some_file.js"
-            # or "src/node_modules/file.js"
-            if f"/{dir_pattern}/" in f"/{relative_path_str}" or relative_path_str.startswith(dir_pattern + "/"):
-                 return True
-        # Exact file/dir name match
-        elif pattern == path.name: # Match file/dir name directly
-            return True
-        # Wildcard for extension (e.g., *.pyc)
-        elif pattern.startswith("*."):
-            ext = pattern[1:] # .pyc
-            if path.name.endswith(ext):
-                return True
-        # Direct path match (e.g., specific_folder/specific_file.txt)
-        elif pattern == relative_path_str:
-            return True
-    return False
+        if pattern.startswith('!'):
+            if pattern[1:]:
+                negative.append(_ignore_pattern_to_regex(pattern[1:]))
+        else:
+            positive.append(_ignore_pattern_to_regex(pattern))
+    if not positive:
+        return lambda _relative_path: False
+    fused = "|".join(positive)
+    if negative: # One lookahead rejects every negated path before the positive alternation runs
+        fused = f"(?!(?:{'|'.join(negative)})\\Z)(?:{fused})"
+    return re.compile(fused, re.DOTALL).fullmatch
+
+
+# Hardcoded common exclusions (less critical now with .ai_ignore)
+# These can be moved to the default .ai_ignore_example
+# Built once at import rather than on every /add scan.
+EXCLUDED_DIRS_HARDCODED = frozenset({".git", "__pycache__", "node_modules", ".venv", "venv", ".vscode", ".idea", "dist", "build"})
+EXCLUDED_EXTENSIONS_HARDCODED = frozenset({
+    ".pyc", ".pyo", ".pyd", ".so", ".o", ".a", ".dll", ".exe", # Compiled
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff", ".webp", ".svg", # Images
+    ".mp3", ".wav", ".ogg", ".mp4", ".avi", ".mov", ".webm", # Media
+    ".zip", ".tar", ".gz", ".rar", ".7z", # Archives
+    ".pdf", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", # Documents
+    ".log", ".tmp", ".temp", ".bak", ".swp", # Logs & temp
+    ".db", ".sqlite", ".sqlite3" # Databases
+})
+# Known source/text extensions: these skip the binary sniff, so the common case costs no extra open+read
+TEXT_EXTENSIONS = frozenset({
+    ".py", ".pyi", ".js", ".jsx", ".ts", ".tsx", ".md", ".rst", ".txt", ".json", ".yaml", ".yml", ".toml",
+    ".ini", ".cfg", ".html", ".css", ".scss", ".rs", ".go", ".c", ".h", ".cpp", ".hpp", ".java", ".kt",
+    ".rb", ".php", ".sh", ".sql", ".xml", ".csv",
+})
+
+def _iter_scan_files(root_dir: Path, ignore_matcher: Callable[[str], bool], excluded_dirs: frozenset,
+                     skipped_files_info: List[Tuple[str, str]]) -> Iterator[Tuple[os.DirEntry, str]]:
+    """
+    Walk root_dir with os.scandir, yielding (entry, relative POSIX path) for every file.
+    Excluded and ignored directories are pruned here, so their subtrees are never listed.
+    """
+    pending_dirs = [(str(root_dir), "")] # (absolute dir path, relative prefix)
+    while pending_dirs:
+        dir_path, relative_prefix = pending_dirs.pop()
+        try:
+            with os.scandir(dir_path) as dir_entries:
+                entries = list(dir_entries)
+        except OSError as e:
+            skipped_files_info.append((dir_path, f"Error reading: {e}"))
+            continue
 
+        subdirs = []
+        for entry in entries:
+            relative_path = relative_prefix + entry.name
+            if entry.is_dir(follow_symlinks=False): # d_type from readdir, no stat; never follow dir symlinks (cycles)
+                if entry.name in excluded_dirs:
+                    skipped_files_info.append((entry.path, "In hardcoded excluded dirs"))
+                elif ignore_matcher(relative_path + "/"):
+                    skipped_files_info.append((entry.path, "Matches .ai_ignore pattern"))
+                else:
+                    subdirs.append((entry.path, relative_path + "/"))
+            elif entry.is_file():
+                yield entry, relative_path
+        pending_dirs.extend(reversed(subdirs)) # Pop subdirectories in listing order
+
+SCAN_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SCAN_MAX_IN_FLIGHT = SCAN_MAX_WORKERS * 4 # Submitted-but-unconsumed reads; bounds memory and open files on huge trees
+
+def _bounded_ordered_map(executor: ThreadPoolExecutor, fn: Callable, items) -> Iterator:
+    """Like executor.map, but pulls items lazily and keeps at most SCAN_MAX_IN_FLIGHT tasks submitted."""
+    pending = deque()
+    for item in items:
+        if len(pending) >= SCAN_MAX_IN_FLIGHT:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
+
+def _load_scan_candidate(entry: os.DirEntry) -> Tuple[str, Optional[str], Optional[str]]:
+    """Classify and read one directory-scan candidate. Returns (path, skip_reason, content); runs on a worker thread."""
+    try:
+        # DirEntry caches its stat result, and oversized files are rejected before anything is opened
+        stat_result = entry.stat()
+        if stat_result.st_size > 5_000_000: # 5MB limit per file
+            return entry.path, "Exceeds 5MB size limit", None
+        if os.path.splitext(entry.name)[1].lower() not in TEXT_EXTENSIONS \
+                and _is_binary_cached(entry.path, stat_result.st_mtime_ns, stat_result.st_size):
+            return entry.path, "Binary file", None
+        return entry.path, None, _read_local_file_normalized(entry.path) # Scan root is already normalized
+    except Exception as e:
+        return entry.path, f"Error reading: {e}", None
 
 def add_directory_to_conversation(directory_path_str: str, ignore_patterns: List[str]):
     global conversation_history
@@ -588,119 +850,279 @@ def add_directory_to_conversation(directory_path_str: str, ignore_patterns: List
 
     console.print(f"Scanning directory: [cyan]{normalized_dir_path}[/cyan]...")
 
-    # Hardcoded common exclusions (less critical now with .ai_ignore)
-    # These can be moved to the default .ai_ignore_example
-    excluded_dirs_hardcoded = {".git", "__pycache__", "node_modules", ".venv", "venv", ".vscode", ".idea"}
-    excluded_extensions_hardcoded = {
-        ".pyc", ".pyo", ".pyd", ".so", ".o", ".a", ".dll", ".exe", # Compiled
-        ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff", ".webp", ".svg", # Images
-        ".mp3", ".wav", ".ogg", ".mp4", ".avi", ".mov", ".webm", # Media
-        ".zip", ".tar", ".gz", ".rar", ".7z", # Archives
-        ".pdf", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx", # Documents
-        ".log", ".tmp", ".temp", ".bak", ".swp", # Logs & temp
-        ".db", ".sqlite", ".sqlite3" # Databases
-    }
-
     added_files_count = 0
     skipped_files_info = [] # Store (path, reason)
 
     # Use normalized_dir_path as the root for pattern matching
     scan_root_dir = normalized_dir_path
-
-    for item in normalized_dir_path.rglob("*"): # Recursive glob
-        if item.is_file():
-            # Check hardcoded dir exclusions first (for parent dirs)
-            if any(excluded_dir in item.parts for excluded_dir in excluded_dirs_hardcoded):
-                skipped_files_info.append((str(item), "Parent in hardcoded excluded dirs"))
+    ignore_matcher = compile_ignore_patterns(tuple(ignore_patterns)) # One fused regex for the whole scan
+
+    def scan_candidates() -> Iterator[os.DirEntry]:
+        """Files that pass the cheap name-based filters, yielded as the walk finds them."""
+        # Plain str ops on the DirEntry fields; a Path per file would be parsed just to read its name and suffix.
+        # Cheapest predicates first: set lookups, then the ignore regex. The stat-based size check, the binary
+        # sniff and the read follow on the worker threads (_load_scan_candidate).
+        for entry, relative_path in _iter_scan_files(scan_root_dir, ignore_matcher, EXCLUDED_DIRS_HARDCODED, skipped_files_info):
+            suffix = os.path.splitext(entry.name)[1]
+            if suffix.lower() in EXCLUDED_EXTENSIONS_HARDCODED:
+                skipped_files_info.append((entry.path, f"Hardcoded excluded extension ({suffix})"))
                 continue
-            if item.name in excluded_dirs_hardcoded: # If file itself is named like an excluded dir (unlikely but possible)
-                 skipped_files_info.append((str(item), "In hardcoded excluded files/dirs"))
+
+            if entry.name in EXCLUDED_DIRS_HARDCODED: # If file itself is named like an excluded dir (unlikely but possible)
+                 skipped_files_info.append((entry.path, "In hardcoded excluded files/dirs"))
                  continue
 
             # Check .ai_ignore patterns
-            if path_matches_ignore(item, ignore_patterns, scan_root_dir):
-                skipped_files_info.append((str(item), "Matches .ai_ignore pattern"))
+            if ignore_matcher(relative_path):
+                skipped_files_info.append((entry.path, "Matches .ai_ignore pattern"))
                 continue
 
-            if item.suffix.lower() in excluded_extensions_hardcoded:
-                skipped_files_info.append((str(item), f"Hardcoded excluded extension ({item.suffix})"))
-                continue
+            yield entry
 
-            if is_binary_file(str(item)):
-                skipped_files_info.append((str(item), "Binary file"))
+    # The stat, binary check and read are I/O-bound, so overlap them across a thread pool while the walk continues.
+    # Results come back in submission order, keeping the context order deterministic.
+    with ThreadPoolExecutor(max_workers=SCAN_MAX_WORKERS) as executor:
+        for file_path, skip_reason, content in _bounded_ordered_map(executor, _load_scan_candidate, scan_candidates()):
+            if skip_reason:
+                skipped_files_info.append((file_path, skip_reason))
                 continue
-
-            try:
-                if item.stat().st_size > 5_000_000: # 5MB limit per file
-                    skipped_files_info.append((str(item), "Exceeds 5MB size limit"))
-                    continue
-
-                content = read_local_file(str(item))
-                # Add to conversation history (ensure it's not already there)
-                file_marker_content = f"Content of file '{str(item)}':\n\n{content}"
-                if not any(msg.get("role") == "system" and msg.get("content","").startswith(f"Content of file '{str(item)}':") for msg in conversation_history):
-                    conversation_history.append({"role": "system", "content": file_marker_content, "type": "file_context", "path": str(item)})
-                    added_files_count += 1
-                else:
-                    skipped_files_info.append((str(item), "Already in context"))
-
-
-            except Exception as e:
-                skipped_files_info.append((str(item), f"Error reading: {e}"))
-        elif item.is_dir(): # For directories, check if they match ignore patterns to skip scanning them
-            if any(excluded_dir in item.parts for excluded_dir in excluded_dirs_hardcoded) or \
-               path_matches_ignore(item, ignore_patterns, scan_root_dir) or \
-               item.name in excluded_dirs_hardcoded:
-                # If a directory is ignored, rglob won't enter it if we could prune it.
-                # However, rglob yields all items then we filter.
-                # For more efficient skipping, os.walk would be better to prune DIRS.
-                # For now, this just means files within it will be skipped individually.
-                pass
-
+            # Add to conversation history (ensure it's not already there)
+            if file_path not in file_context_index:
+                append_file_context(file_path, content)
+                added_files_count += 1
+            else:
+                skipped_files_info.append((file_path, "Already in context"))
 
     console.print(f"[green]✓[/green] Added {added_files_count} new files from '[cyan]{normalized_dir_path}[/cyan]' to conversation context.")
     if skipped_files_info:
         console.print(f"[yellow]Skipped {len(skipped_files_info)} files/items.[/yellow] (Use /list_skipped for details)")
         # Store skipped files info for potential review by user, e.g. via a new command /list_skipped_files
-        # For now, just print a summary or first few.
-        if any(s[1] == "Matches .ai_ignore pattern" for s in skipped_files_info):
-             console.print(f"[dim]Some files were skipped due to '.ai_ignore' patterns.[/dim]")
+        # For now, print the most common reasons, counted in one pass and emitted as a single plain-text print.
+        skip_reasons = Counter(reason for _path, reason in skipped_files_info)
+        console.print("\n".join(f"  {count:>6}  {reason}" for reason, count in skip_reasons.most_common(5)),
+                      style="dim", markup=False, highlight=False)
 
 
 # --------------------------------------------------------------------------------
 # 6. Conversation History Management (Context Trimming, Adding files)
 # --------------------------------------------------------------------------------
+# --- Cross-file dedup of file_context content ---
+# File content is cut into content-defined blocks; a block already present verbatim in another file in context
+# is replaced by a one-line pointer to that copy, so overlapping /adds do not pay for the same text twice.
+DEDUP_BOUNDARY_MASK = 0x3F # A line whose crc32 has these bits clear ends a block (~64-line blocks on average)
+DEDUP_MIN_BLOCK_LINES = 8 # Blocks are never cut shorter than this, and shorter ones are never replaced
+_context_blocks: Dict[bytes, str] = {} # sha256(block) -> path of the context holding the verbatim copy
+_context_block_digests: Dict[str, List[bytes]] = {} # path -> digests it owns in _context_blocks
+_dedup_dependents: Dict[str, Set[str]] = {} # owner path -> paths whose context points at its blocks
+_dedup_originals: Dict[str, str] = {} # path -> full content, for contexts that had blocks replaced
+FILE_CONTEXT_PREFIX = "Content of file '{}':\n\n"
+
+def _content_blocks(lines: List[str]) -> Iterator[Tuple[int, int]]:
+    """Yield (start, end) line ranges; boundaries depend only on line content, so they survive edits elsewhere."""
+    start = 0
+    for i, line in enumerate(lines):
+        if i + 1 - start >= DEDUP_MIN_BLOCK_LINES and zlib.crc32(line.encode("utf-8")) & DEDUP_BOUNDARY_MASK == 0:
+            yield start, i + 1
+            start = i + 1
+    if start < len(lines):
+        yield start, len(lines)
+
+def dedup_file_context(normalized_path: str, content: str) -> str:
+    """Register content's blocks and return it with blocks owned by other files in context replaced by pointers."""
+    lines = content.split("\n")
+    kept_blocks, owner_paths = [], set()
+    for start, end in _content_blocks(lines):
+        block = "\n".join(lines[start:end])
+        digest = hashlib.sha256(block.encode("utf-8")).digest()
+        owner_path = _context_blocks.get(digest)
+        if owner_path is not None and owner_path != normalized_path and end - start >= DEDUP_MIN_BLOCK_LINES:
+            # Cited by its first line, not line numbers: the owner's own pointers shift its displayed lines
+            first_line = next((line.strip() for line in lines[start:end] if line.strip()), "")[:80]
+            kept_blocks.append(f"# <duplicated from {owner_path}: the {end - start}-line block starting {first_line!r}>")
+            owner_paths.add(owner_path)
+            continue
+        if owner_path is None:
+            _context_blocks[digest] = normalized_path
+            _context_block_digests.setdefault(normalized_path, []).append(digest)
+        kept_blocks.append(block)
+    if not owner_paths:
+        return content
+    for owner_path in owner_paths:
+        _dedup_dependents.setdefault(owner_path, set()).add(normalized_path)
+    _dedup_originals[normalized_path] = content
+    return "\n".join(kept_blocks)
+
+def set_file_context_content(msg: Dict[str, Any], normalized_path: str, content: str):
+    """
+    Fill a file_context message with content, deduped against the other contexts. A deduped message also carries the
+    full content as dedup_original, so a saved session can rebuild the block index and re-expand its pointers later.
+    """
+    msg["content"] = FILE_CONTEXT_PREFIX.format(normalized_path) + dedup_file_context(normalized_path, content)
+    if normalized_path in _dedup_originals:
+        msg["dedup_original"] = content
+    else:
+        msg.pop("dedup_original", None)
+
+def file_context_original(msg: Dict[str, Any]) -> str:
+    """Full file content of a file_context message, whether or not it was deduped."""
+    original = msg.get("dedup_original")
+    if original is not None:
+        return original
+    prefix = FILE_CONTEXT_PREFIX.format(msg["path"])
+    return msg["content"][len(prefix):] if msg["content"].startswith(prefix) else msg["content"]
+
+def _reexpand_file_context(normalized_path: str):
+    """Restore the full content of a deduped context whose block owner left the context."""
+    content = _dedup_originals.pop(normalized_path)
+    for digest in _context_block_digests.pop(normalized_path, ()):
+        _context_blocks.pop(digest, None)
+    msg = file_context_index.get(normalized_path)
+    if msg is not None:
+        set_file_context_content(msg, normalized_path, content)
+        _message_token_cache.pop(id(msg), None)
+        invalidate_session_log()
+
+def forget_file_context(normalized_path: Optional[str]):
+    """Bookkeeping for a file_context message that was removed from conversation_history."""
+    file_context_index.pop(normalized_path, None)
+    for digest in _context_block_digests.pop(normalized_path, ()):
+        _context_blocks.pop(digest, None)
+    _dedup_originals.pop(normalized_path, None)
+    for dependent_path in _dedup_dependents.pop(normalized_path, ()):
+        if dependent_path in _dedup_originals: # Still in context and still pointing at blocks that are now gone
+            _reexpand_file_context(dependent_path)
+
+def reset_file_context_index():
+    """Drop all file-context bookkeeping; conversation_history no longer holds (or never held) these messages."""
+    for index in (file_context_index, _context_blocks, _context_block_digests, _dedup_dependents, _dedup_originals):
+        index.clear()
+
+def append_file_context(normalized_path: str, content: str):
+    """Append a file_context message and record it in file_context_index."""
+    msg = {
+        "role": "system",
+        "type": "file_context", # Mark it for easier management
+        "path": normalized_path
+    }
+    set_file_context_content(msg, normalized_path, content)
+    conversation_history.append(msg)
+    file_context_index[normalized_path] = msg
+
+def refresh_file_context(normalized_path: str, content: str):
+    """Swap new content into the file's existing context message (no re-read, no history scan), or append one."""
+    msg = file_context_index.get(normalized_path)
+    if msg is None:
+        append_file_context(normalized_path, content)
+        return
+    forget_file_context(normalized_path) # Old blocks are gone; re-expands any contexts that pointed at them
+    set_file_context_content(msg, normalized_path, content)
+    _message_token_cache.pop(id(msg), None)
+    invalidate_session_log() # Changed in place, so an append-only session save would miss it
+    file_context_index[normalized_path] = msg
+
+def rebuild_file_context_index():
+    """
+    Resync file_context_index after conversation_history was replaced or filtered wholesale. Contexts new to the
+    index (e.g. from a loaded session) are re-registered for dedup from their full content, in history order, so
+    their pointers are tracked and get re-expanded if the file they point at leaves the context.
+    """
+    live_contexts = {msg["path"]: msg for msg in conversation_history if msg.get("type") == "file_context" and "path" in msg}
+    for normalized_path in file_context_index.keys() - live_contexts.keys():
+        forget_file_context(normalized_path)
+    for normalized_path, msg in live_contexts.items():
+        if file_context_index.get(normalized_path) is msg:
+            continue
+        previous_content = msg["content"]
+        set_file_context_content(msg, normalized_path, file_context_original(msg))
+        if msg["content"] != previous_content:
+            _message_token_cache.pop(id(msg), None)
+            invalidate_session_log()
+        file_context_index[normalized_path] = msg
+
+_message_token_cache: Dict[int, Tuple[Dict[str, Any], int]] = {} # id(msg) -> (msg, tokens); holding msg keeps its id unique
+TRIM_TARGET_RATIO = 0.75 # A token-triggered trim cuts down to this share of the budget, so it does not re-fire every turn
+
+def message_tokens(msg: Dict[str, Any]) -> int:
+    """Token count of one history message, computed once per message object."""
+    cached = _message_token_cache.get(id(msg))
+    if cached is not None and cached[0] is msg:
+        return cached[1]
+    try:
+        count = _get_litellm().token_counter(model=current_llm_model, messages=[msg])
+    except Exception: # Unknown model/tokenizer: fall back to the usual ~4 characters per token estimate
+        count = len(str(msg.get("content") or "")) // 4 + len(str(msg.get("tool_calls") or "")) // 4 + 4
+    _message_token_cache[id(msg)] = (msg, count)
+    return count
+
+def _drop_oldest_messages(messages: List[Dict[str, Any]], tokens_to_free: int) -> List[Dict[str, Any]]:
+    """
+    Drop leading messages until tokens_to_free are freed, without starting the kept tail on an orphaned tool reply.
+    The current turn (from the last user message on) is never dropped.
+    """
+    current_turn = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]["role"] == "user"), len(messages))
+    start, freed = 0, 0
+    while start < current_turn and freed < tokens_to_free:
+        freed += message_tokens(messages[start])
+        start += 1
+    while start < current_turn and messages[start]["role"] == "tool":
+        start += 1
+    return messages[start:]
+
 def trim_conversation_history():
     """Trim conversation history to prevent token limit issues."""
     global conversation_history, config
-    # A more sophisticated trimming would estimate token count.
-    # For now, simple message count based, preserving system prompt and recent messages.
+    # Trims on message count (max_messages) and on the estimated token total (config "max_tokens_context"),
+    # preserving the system prompt and the most recent messages.
     # LiteLLM can also do its own context window management.
 
     max_messages = 30 # Keep last N user/assistant messages + system prompts + file contexts
-
-    system_prompts = [msg for msg in conversation_history if msg["role"] == "system" and msg.get("type") != "file_context"]
-    file_contexts = [msg for msg in conversation_history if msg.get("type") == "file_context"]
-
-    # User and assistant messages, excluding tool responses for this count
-    # Tool responses are tightly coupled with their preceding assistant message and subsequent assistant message.
-    # A better trimming would keep tool_call -> tool_response -> assistant_response blocks together.
+    token_budget = config.get("max_tokens_context", DEFAULT_CONFIG["max_tokens_context"])
 
     # Let's try a simpler approach: keep system prompt, all file contexts, and last N other messages.
-    # This might still exceed token limits if file contexts are huge.
-
-    other_messages = [msg for msg in conversation_history if msg.get("type") != "file_context" and msg["role"] != "system"]
+    # File contexts are only evicted (oldest first) when the chat alone cannot bring the total under budget.
+
+    # One pass splits history into its three buckets and totals the token counts (cached per message).
+    # Between trims history only grows to 2 * max_messages chat messages, so this pass stays bounded per turn.
+    system_prompts, file_contexts, other_messages = [], [], []
+    total_tokens = 0
+    for msg in conversation_history:
+        if msg.get("type") == "file_context":
+            file_contexts.append(msg)
+        elif msg["role"] == "system":
+            system_prompts.append(msg)
+        else:
+            other_messages.append(msg)
+        total_tokens += message_tokens(msg)
+
+    if len(_message_token_cache) > len(conversation_history): # Forget messages removed by /clear_context, /remove_context, etc.
+        live_ids = {id(msg) for msg in conversation_history}
+        for msg_id in [msg_id for msg_id in _message_token_cache if msg_id not in live_ids]:
+            del _message_token_cache[msg_id]
+
+    # Deferred truncation: let the chat grow to twice the window (or past the token budget), then cut back in one go.
+    # In between, history is append-only, so the prefix sent to the provider is identical from turn to turn
+    # and provider-side prompt caching keeps hitting, instead of missing every turn as a sliding window moves.
+    if len(other_messages) <= 2 * max_messages and total_tokens <= token_budget:
+        return
 
+    other_messages_to_keep = other_messages
     if len(other_messages) > max_messages:
-        other_messages_to_keep = other_messages[-max_messages:]
-    else:
-        other_messages_to_keep = other_messages
+        other_messages_to_keep = _drop_oldest_messages(other_messages[-max_messages:], 0)
+
+    main_system_prompt = system_prompts[:1] # Should always be exactly one (the main system prompt)
+    excess_tokens = sum(message_tokens(msg) for msg in main_system_prompt + file_contexts + other_messages_to_keep) \
+        - int(token_budget * TRIM_TARGET_RATIO)
+    if excess_tokens > 0:
+        kept_chat = _drop_oldest_messages(other_messages_to_keep, excess_tokens)
+        excess_tokens -= sum(message_tokens(msg) for msg in other_messages_to_keep[:len(other_messages_to_keep) - len(kept_chat)])
+        other_messages_to_keep = kept_chat
+        while file_contexts and excess_tokens > 0: # Oldest files go first
+            excess_tokens -= message_tokens(file_contexts.pop(0))
 
     # Rebuild, ensuring system prompt is first.
     new_history = []
-    if system_prompts: # Should always be at least one (the main system prompt)
-        new_history.append(system_prompts[0]) # Main system prompt
-    new_history.extend(file_contexts) # Add all file contexts
+    new_history.extend(main_system_prompt) # Main system prompt
+    new_history.extend(file_contexts) # Add remaining file contexts
     new_history.extend(other_messages_to_keep) # Add recent interactions
 
     # Add any other system prompts (e.g., loaded file content that wasn't marked as file_context type)
@@ -711,6 +1133,39 @@ def trim_conversation_history():
         console.print(f"[dim]Trimmed conversation history from {len(conversation_history)} to {len(new_history)} messages.[/dim]")
 
     conversation_history = new_history
+    rebuild_file_context_index() # Token trimming may have evicted file contexts
+
+
+def head_lines(text: str, n: int) -> Tuple[List[str], bool]:
+    """Return the first n lines of text and whether more follow, without splitting the whole string."""
+    lines: List[str] = []
+    start = 0
+    while len(lines) < n:
+        end = text.find("\n", start)
+        if end == -1:
+            if start < len(text):
+                lines.append(text[start:])
+            return lines, False
+        lines.append(text[start:end])
+        start = end + 1
+    return lines, start < len(text)
+
+
+def refresh_main_system_prompt():
+    """
+    Set the main system prompt (role "system", no "type") to the prompt for the current model and workspace.
+    It is kept at index 0, so this is normally one check plus a cached get_system_prompt();
+    otherwise it is found and moved to the front, or created.
+    """
+    if conversation_history and conversation_history[0]["role"] == "system" and not conversation_history[0].get("type"):
+        conversation_history[0]["content"] = get_system_prompt()
+        return
+    for i, msg in enumerate(conversation_history):
+        if msg["role"] == "system" and not msg.get("type"):
+            conversation_history.insert(0, conversation_history.pop(i))
+            msg["content"] = get_system_prompt()
+            return
+    conversation_history.insert(0, {"role": "system", "content": get_system_prompt()})
 
 
 def ensure_file_in_context(file_path_str: str) -> bool:
@@ -719,20 +1174,12 @@ def ensure_file_in_context(file_path_str: str) -> bool:
     normalized_path = normalize_path_str(file_path_str)
 
     # Check if file content is already in history
-    # This check needs to be robust. Comparing full content string might be too much.
-    # We'll check for the specific marker.
-    file_marker_prefix = f"Content of file '{normalized_path}':"
-    if any(msg.get("role") == "system" and msg.get("content","").startswith(file_marker_prefix) for msg in conversation_history):
+    if normalized_path in file_context_index:
         return True # Already in context
 
     try:
         content = read_local_file(normalized_path)
-        conversation_history.append({
-            "role": "system",
-            "content": f"{file_marker_prefix}\n\n{content}",
-            "type": "file_context", # Mark it for easier management
-            "path": normalized_path
-        })
+        append_file_context(normalized_path, content)
         console.print(f"[dim]Added file '{normalized_path}' to context for operation.[/dim]")
         return True
     except Exception as e:
@@ -742,6 +1189,96 @@ def ensure_file_in_context(file_path_str: str) -> bool:
 # --------------------------------------------------------------------------------
 # 7. LLM Interaction with LiteLLM and Function Calling
 # --------------------------------------------------------------------------------
+def _read_file_result(normalized_path: str) -> str:
+    """Read one file for read_multiple_files, returning its tool-result block or an error line."""
+    try:
+        return f"Content of file '{normalized_path}':\n\n{read_local_file(normalized_path)}"
+    except Exception as e:
+        return f"Error reading '{normalized_path}': {e}"
+
+@functools.lru_cache(maxsize=None)
+def _file_read_pool() -> ThreadPoolExecutor:
+    """
+    Shared pool for read_multiple_files, created on first use so each call does not spawn fresh threads.
+    Only leaf reads run here (they never wait on other tasks), so sharing it cannot deadlock.
+    """
+    return ThreadPoolExecutor(max_workers=16, thread_name_prefix="read_multiple_files")
+
+def _tool_read_file(arguments: Dict[str, Any]) -> str:
+    normalized_path = normalize_path_str(arguments["file_path"])
+    content = _read_local_file_normalized(normalized_path)
+    return f"Content of file '{normalized_path}':\n\n{content}"
+
+def _tool_read_multiple_files(arguments: Dict[str, Any]) -> str:
+    normalized_paths = [normalize_path_str(fp_str) for fp_str in arguments["file_paths"]] # Normalize once, up front
+    if len(normalized_paths) > 1:
+        results = list(_file_read_pool().map(_read_file_result, normalized_paths)) # map keeps the requested order
+    else:
+        results = [_read_file_result(p) for p in normalized_paths]
+    return "\n\n" + "="*20 + " MULTIPLE FILE RESULTS " + "="*20 + "\n\n".join(results)
+
+def _tool_create_file(arguments: Dict[str, Any]) -> str:
+    file_to_create = FileToCreate(**arguments)
+    normalized_path = normalize_path_str(file_to_create.path)
+    _create_local_file_normalized(normalized_path, file_to_create.content)
+    return f"Successfully created/updated file '{normalized_path}'."
+
+def _tool_create_multiple_files(arguments: Dict[str, Any]) -> str:
+    files_to_create = FILES_TO_CREATE_ADAPTER.validate_python(arguments["files"])
+    created_files_paths = []
+    for file_to_create in files_to_create:
+        normalized_path = normalize_path_str(file_to_create.path)
+        _create_local_file_normalized(normalized_path, file_to_create.content)
+        created_files_paths.append(normalized_path)
+    return f"Successfully created/updated {len(created_files_paths)} files: {', '.join(created_files_paths)}."
+
+def _tool_edit_file(arguments: Dict[str, Any]) -> str:
+    file_to_edit = FileToEdit(**arguments)
+    # CRITICAL: Ensure file is in context for the LLM to have based original_snippet on.
+    # The LLM is prompted to call read_file first. This function ensures it again if needed.
+    if not ensure_file_in_context(file_to_edit.path):
+         # If ensure_file_in_context fails, it prints an error.
+         # We should return an error message to the LLM.
+         raise ValueError(f"Could not ensure file '{file_to_edit.path}' was in context. Edit aborted.")
+
+    normalized_path = normalize_path_str(file_to_edit.path)
+    updated_content = apply_local_diff_edit(normalized_path, file_to_edit.original_snippet, file_to_edit.new_snippet)
+    # After edit, the context version of this file is stale.
+    # apply_local_diff_edit already has the new text in memory, so swap it in rather than re-reading the file.
+    if updated_content is not None:
+        refresh_file_context(normalized_path, updated_content)
+    return f"Successfully applied edit to file '{normalized_path}'."
+
+def _tool_list_directory_contents(arguments: Dict[str, Any]) -> str:
+    dir_path_str = arguments.get("directory_path") # Optional
+    if dir_path_str:
+        target_dir = Path(normalize_path_str(dir_path_str))
+    elif current_workspace_root:
+        target_dir = current_workspace_root
+    else:
+        target_dir = Path(session_cwd)
+
+    if not target_dir.is_dir():
+        raise ValueError(f"'{target_dir}' is not a valid directory.")
+
+    items = []
+    for item in target_dir.iterdir():
+        item_type = "dir" if item.is_dir() else "file"
+        items.append(f"- {item.name} ({item_type})")
+    if not items:
+        return f"Directory '{target_dir}' is empty."
+    return f"Contents of directory '{target_dir}':\n" + "\n".join(items)
+
+# Tool name -> handler(arguments) returning the result text; errors propagate to execute_tool_call's handlers
+TOOL_HANDLERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "read_file": _tool_read_file,
+    "read_multiple_files": _tool_read_multiple_files,
+    "create_file": _tool_create_file,
+    "create_multiple_files": _tool_create_multiple_files,
+    "edit_file": _tool_edit_file,
+    "list_directory_contents": _tool_list_directory_contents,
+}
+
 def execute_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
     """Executes a single tool call and returns a message for conversation history."""
     tool_call_id = tool_call.get("id", f"call_{uuid.uuid4().hex[:8]}") # Ensure there's an ID
@@ -761,7 +1298,7 @@ def execute_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
     raw_arguments = function_call_details.get("arguments", "{}")
     try:
         if isinstance(raw_arguments, str):
-            arguments = json.loads(raw_arguments)
+            arguments = json_loads(raw_arguments)
         elif isinstance(raw_arguments, dict):
             arguments = raw_arguments
         else:
@@ -787,79 +1324,10 @@ def execute_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
 
     console.print(f"Attempting to execute tool: [bright_magenta]{function_name}[/bright_magenta] with args: [dim]{arguments}[/dim]")
 
-    result_content = ""
+    handler = TOOL_HANDLERS.get(function_name)
     try:
-        if function_name == "read_file":
-            file_path = arguments["file_path"]
-            # normalized_path = normalize_path_str(file_path) # read_local_file does this
-            content = read_local_file(file_path) # Use original path, normalize inside
-            result_content = f"Content of file '{normalize_path_str(file_path)}':\n\n{content}"
-
-        elif function_name == "read_multiple_files":
-            file_paths = arguments["file_paths"]
-            results = []
-            for fp_str in file_paths:
-                try:
-                    # normalized_fp = normalize_path_str(fp_str) # read_local_file does this
-                    content = read_local_file(fp_str)
-                    results.append(f"Content of file '{normalize_path_str(fp_str)}':\n\n{content}")
-                except Exception as e:
-                    results.append(f"Error reading '{normalize_path_str(fp_str)}': {e}")
-            result_content = "\n\n" + "="*20 + " MULTIPLE FILE RESULTS " + "="*20 + "\n\n".join(results)
-
-        elif function_name == "create_file":
-            # Pydantic validation can be added here for more robustness
-            file_to_create = FileToCreate(**arguments)
-            create_local_file(file_to_create.path, file_to_create.content)
-            result_content = f"Successfully created/updated file '{normalize_path_str(file_to_create.path)}'."
-
-        elif function_name == "create_multiple_files":
-            files_data = arguments["files"]
-            created_files_paths = []
-            for file_info_dict in files_data:
-                file_to_create = FileToCreate(**file_info_dict)
-                create_local_file(file_to_create.path, file_to_create.content)
-                created_files_paths.append(normalize_path_str(file_to_create.path))
-            result_content = f"Successfully created/updated {len(created_files_paths)} files: {', '.join(created_files_paths)}."
-
-        elif function_name == "edit_file":
-            file_to_edit = FileToEdit(**arguments)
-            # CRITICAL: Ensure file is in context for the LLM to have based original_snippet on.
-            # The LLM is prompted to call read_file first. This function ensures it again if needed.
-            if not ensure_file_in_context(file_to_edit.path):
-                 # If ensure_file_in_context fails, it prints an error.
-                 # We should return an error message to the LLM.
-                 raise ValueError(f"Could not ensure file '{file_to_edit.path}' was in context. Edit aborted.")
-
-            apply_local_diff_edit(file_to_edit.path, file_to_edit.original_snippet, file_to_edit.new_snippet)
-            result_content = f"Successfully applied edit to file '{normalize_path_str(file_to_edit.path)}'."
-            # After edit, the context version of this file is stale.
-            # We could re-add it, or let the LLM re-read if needed.
-            # For now, remove the old context message.
-            remove_file_from_context(normalize_path_str(file_to_edit.path), quiet=True)
-            ensure_file_in_context(file_to_edit.path) # Add the new version
-
-        elif function_name == "list_directory_contents":
-            dir_path_str = arguments.get("directory_path") # Optional
-            if dir_path_str:
-                target_dir = Path(normalize_path_str(dir_path_str))
-            elif current_workspace_root:
-                target_dir = current_workspace_root
-            else:
-                target_dir = Path.cwd()
-
-            if not target_dir.is_dir():
-                raise ValueError(f"'{target_dir}' is not a valid directory.")
-
-            items = []
-            for item in target_dir.iterdir():
-                item_type = "dir" if item.is_dir() else "file"
-                items.append(f"- {item.name} ({item_type})")
-            if not items:
-                result_content = f"Directory '{target_dir}' is empty."
-            else:
-                result_content = f"Contents of directory '{target_dir}':\n" + "\n".join(items)
-
+        if handler:
+            result_content = handler(arguments)
         else:
             result_content = f"Error: Unknown function '{function_name}'."
             console.print(f"[red]{result_content}[/red]")
@@ -891,23 +1359,62 @@ def execute_tool_call(tool_call: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+MARKDOWN_RESULT_MAX_CHARS = 4096 # Longer tool results are printed as plain text
+
+READ_ONLY_TOOLS = frozenset({"read_file", "read_multiple_files", "list_directory_contents"})
+TOOL_MAX_WORKERS = 8
+
+def execute_tool_calls(tool_calls: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Execute tool calls in their original order, yielding one result message per call.
+    Consecutive read-only calls run concurrently; any other call is a barrier that runs alone,
+    so a read requested after an edit in the same batch still sees the edited file.
+    """
+    read_only_run: List[Dict[str, Any]] = []
+    for tool_call in tool_calls:
+        if tool_call.get("function", {}).get("name") in READ_ONLY_TOOLS:
+            read_only_run.append(tool_call)
+            continue
+        yield from _execute_read_only_run(read_only_run)
+        read_only_run = []
+        yield execute_tool_call(tool_call)
+    yield from _execute_read_only_run(read_only_run)
+
+def _execute_read_only_run(tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if len(tool_calls) < 2:
+        return [execute_tool_call(tool_call) for tool_call in tool_calls]
+    with ThreadPoolExecutor(max_workers=min(len(tool_calls), TOOL_MAX_WORKERS)) as executor:
+        return list(executor.map(execute_tool_call, tool_calls)) # map keeps results in call order
+
+
 def call_litellm_api(current_conversation: List[Dict[str, Any]], max_retries=2) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str], Optional[List[Dict[str,Any]]]]:
     """
     Calls LiteLLM API.
     Returns (tool_calls_list, final_text_content, new_assistant_messages_for_history)
     """
     global current_llm_model, config
+    litellm = _get_litellm()
 
     console.print(f"\n[bold bright_blue]🤖 Assistant ({current_llm_model}) is thinking...[/bold bright_blue]")
 
     # DeepSeek specific 'reasoning_content' is not standard.
     # We'll just collect text and tool calls.
-    full_response_text = ""
+    response_text_parts: List[str] = [] # Joined once after the stream; repeated str += is quadratic on long replies
     accumulated_tool_calls: List[Dict[str, Any]] = [] # Correctly typed list of dicts
 
-    # Prepare messages for LiteLLM, ensuring system prompt is up-to-date
-    messages_for_api = [msg for msg in current_conversation if msg["role"] != "system"]
-    messages_for_api.insert(0, {"role": "system", "content": get_system_prompt()})
+    # Prepare messages for LiteLLM: the (cached) system prompt, then file contexts, then the chat, in one pass.
+    file_context_messages: List[Dict[str, Any]] = []
+    messages_for_api = [system_message_for_api(current_llm_model)]
+    for msg in current_conversation:
+        if msg.get("type") == "file_context":
+            file_context_messages.append({"role": "system", "content": msg["content"]}) # Drop local-only keys (type, path)
+        elif msg["role"] != "system":
+            messages_for_api.append(msg)
+    if file_context_messages:
+        if supports_prompt_caching(current_llm_model): # Second breakpoint: cache the file contexts along with the prompt
+            last_context = file_context_messages[-1]
+            last_context["content"] = [{"type": "text", "text": last_context["content"], "cache_control": {"type": "ephemeral"}}]
+        messages_for_api[1:1] = file_context_messages
 
     try:
         response = litellm.completion(
@@ -921,7 +1428,7 @@ def call_litellm_api(current_conversation: List[Dict[str, Any]], max_retries=2)
 
         # Variables to aggregate streamed tool call parts
         # LiteLLM streams tool calls piece by piece. We need to reconstruct them.
-        # {index: {"id": "", "type": "function", "function": {"name": "", "arguments": ""}}}
+        # {index: {"id": "", "type": "function", "function": {"name": [parts], "arguments": [parts]}}}
         tool_call_fragments: Dict[int, Dict[str, Any]] = {}
 
         for chunk in response:
@@ -930,7 +1437,7 @@ def call_litellm_api(current_conversation: List[Dict[str, Any]], max_retries=2)
             if delta.content:
                 text_part = delta.content
                 console.print(text_part, end="", style="bright_green")
-                full_response_text += text_part
+                response_text_parts.append(text_part)
 
             if delta.tool_calls:
                 for tool_call_chunk in delta.tool_calls:
@@ -940,7 +1447,7 @@ def call_litellm_api(current_conversation: List[Dict[str, Any]], max_retries=2)
                         tool_call_fragments[index] = {
                             "id": None,
                             "type": "function",
-                            "function": {"name": "", "arguments": ""}
+                            "function": {"name": [], "arguments": []}
                         }
 
                     current_fragment = tool_call_fragments[index]
@@ -948,22 +1455,24 @@ def call_litellm_api(current_conversation: List[Dict[str, Any]], max_retries=2)
                         current_fragment["id"] = tool_call_chunk.id
                     if tool_call_chunk.function:
                         if tool_call_chunk.function.name:
-                            current_fragment["function"]["name"] += tool_call_chunk.function.name
+                            current_fragment["function"]["name"].append(tool_call_chunk.function.name)
                         if tool_call_chunk.function.arguments:
-                            current_fragment["function"]["arguments"] += tool_call_chunk.function.arguments
+                            current_fragment["function"]["arguments"].append(tool_call_chunk.function.arguments)
 
         console.print() # Newline after streaming assistant text
+        full_response_text = "".join(response_text_parts)
 
         # Finalize tool calls from fragments
         if tool_call_fragments:
             for _index, fragment in sorted(tool_call_fragments.items()): # Process in order
-                if fragment["id"] and fragment["function"]["name"]: # Basic validation
+                function_name = "".join(fragment["function"]["name"])
+                if fragment["id"] and function_name: # Basic validation
                     accumulated_tool_calls.append({
                         "id": fragment["id"],
                         "type": fragment["type"],
                         "function": {
-                            "name": fragment["function"]["name"],
-                            "arguments": fragment["function"]["arguments"]
+                            "name": function_name,
+                            "arguments": "".join(fragment["function"]["arguments"])
                         }
                     })
 
@@ -1032,7 +1541,7 @@ def process_user_message(user_message: str):
             func_name = tc.get("function", {}).get("name", "N/A")
             args_str = tc.get("function", {}).get("arguments", "{}")
             try: # Pretty print JSON arguments
-                args_pretty = json.dumps(json.loads(args_str), indent=2)
+                args_pretty = json_dumps(json_loads(args_str), indent=True)
             except:
                 args_pretty = args_str
             tool_table.add_row(str(i+1), func_name, args_pretty)
@@ -1068,7 +1577,7 @@ def process_user_message(user_message: str):
                     console.print(f"Editing tool call: [magenta]{tc_to_edit['function']['name']}[/magenta]")
                     current_args_str = tc_to_edit['function']['arguments']
                     try:
-                        current_args_dict = json.loads(current_args_str)
+                        current_args_dict = json_loads(current_args_str)
                     except json.JSONDecodeError:
                         console.print(f"[yellow]Warning: Arguments are not valid JSON. Editing as raw string.[/yellow]")
                         current_args_dict = None
@@ -1085,7 +1594,7 @@ def process_user_message(user_message: str):
                                 else: edited_args_dict[key] = new_val_str
                             except ValueError:
                                 edited_args_dict[key] = new_val_str # Keep as string if parse fails
-                        tc_to_edit['function']['arguments'] = json.dumps(edited_args_dict)
+                        tc_to_edit['function']['arguments'] = json_dumps(edited_args_dict)
                     else: # Edit as raw string
                          new_args_str = Prompt.ask(f"New arguments string (current: '{current_args_str}')", default=current_args_str)
                          tc_to_edit['function']['arguments'] = new_args_str
@@ -1103,12 +1612,18 @@ def process_user_message(user_message: str):
             if "id" not in tool_call_data or not tool_call_data["id"]:
                 tool_call_data["id"] = f"call_{uuid.uuid4().hex[:8]}"
 
-            tool_response_message = execute_tool_call(tool_call_data)
+        for tool_response_message in execute_tool_calls(tool_calls_to_execute):
             tool_results.append(tool_response_message)
             # Display tool result immediately
             console.print(f"  [dim]↳ Result for {tool_response_message['name']} (ID: {tool_response_message['tool_call_id']}):[/dim]")
-            # Use Rich Markdown for potentially formatted content from tools
-            console.print(Markdown(str(tool_response_message['content'])))
+            # Use Rich Markdown for short, potentially formatted content from tools.
+            # File dumps and large results are printed verbatim: Markdown parsing them is slow and mangles code.
+            result_text = str(tool_response_message['content'])
+            if len(result_text) > MARKDOWN_RESULT_MAX_CHARS or (tool_response_message.get('name') or "").startswith("read_"):
+                console.print(result_text, markup=False, highlight=False)
+            else:
+                from rich.markdown import Markdown
+                console.print(Markdown(result_text))
 
 
         conversation_history.extend(tool_results)
@@ -1119,9 +1634,99 @@ def process_user_message(user_message: str):
         console.print("[bold yellow]⚠ Reached maximum tool iteration limit. Ending turn.[/bold yellow]")
 
 
+# --- Session persistence ---
+# A session is <name>.jsonl.gz (one history message per line) plus a small <name>.meta.json (model, workspace).
+# Saving again to the same session appends only the messages added since the last save, as a new gzip member
+# (concatenated members read back as one stream); the log is rewritten in full when earlier history changed
+# (trimming, removals, in-place context refreshes).
+# The main system prompt is refreshed on every load, so its in-place updates never force a rewrite.
+SESSION_FORMAT_VERSION = "2.2"
+SESSION_READ_BUFFER = 1 << 20 # Large reads for big logs; the default 8 KiB means thousands of read() calls
+SESSION_COMPRESS_LEVEL = 3 # File contexts compress well; higher levels cost far more CPU for little gain
+_session_log: Optional[Tuple[str, List[Dict[str, Any]], Dict[str, Any]]] = None # (name, messages on disk, meta on disk)
+
+def invalidate_session_log():
+    """Force the next save to rewrite the session log: a message that may already be on disk changed in place."""
+    global _session_log
+    _session_log = None
+
+def _session_files(session_name: str) -> Tuple[Path, Path, Path, Path]:
+    """(gzipped JSONL log, meta sidecar, uncompressed JSONL log, legacy single-file JSON) paths for a session name."""
+    return (SESSION_DIR / f"{session_name}.jsonl.gz", SESSION_DIR / f"{session_name}.meta.json",
+            SESSION_DIR / f"{session_name}.jsonl", SESSION_DIR / f"{session_name}.json")
+
+def list_saved_sessions() -> List[str]:
+    if not SESSION_DIR.exists():
+        return []
+    names = {f.name[:-len(".jsonl.gz")] for f in SESSION_DIR.glob("*.jsonl.gz")}
+    names.update(f.name[:-len(".jsonl")] for f in SESSION_DIR.glob("*.jsonl")) # Saved before compression
+    names.update(f.stem for f in SESSION_DIR.glob("*.json") if not f.name.endswith(".meta.json")) # Legacy sessions
+    return sorted(names)
+
+def save_session(session_name: str) -> Path:
+    """Persist conversation_history and settings; appends to the session's log when only new messages were added."""
+    global _session_log
+    SESSION_DIR.mkdir(parents=True, exist_ok=True)
+    log_file, meta_file, plain_log_file, _legacy_file = _session_files(session_name)
+
+    persisted = _session_log[1] if _session_log and _session_log[0] == session_name and log_file.exists() else None
+    can_append = (persisted is not None and len(persisted) <= len(conversation_history)
+                  and all(map(operator.is_, persisted, conversation_history))) # Identity check: pointer compares only
+    new_messages = conversation_history[len(persisted):] if can_append else conversation_history
+    # Compressed in memory and written with a single write() rather than through GzipFile's small chunks
+    payload = gzip.compress("".join([json_dumps(msg) + "\n" for msg in new_messages]).encode("utf-8"), compresslevel=SESSION_COMPRESS_LEVEL)
+    if can_append:
+        with open(log_file, "ab") as f: # A torn append is caught on load and triggers a full rewrite
+            f.write(payload)
+    else:
+        write_file_atomic(log_file, payload)
+        plain_log_file.unlink(missing_ok=True) # Superseded by the compressed log
+
+    meta = {
+        "current_llm_model": current_llm_model,
+        "current_workspace_root": str(current_workspace_root) if current_workspace_root else None,
+        "version": SESSION_FORMAT_VERSION # For future compatibility
+    }
+    if not (can_append and _session_log[2] == meta and meta_file.exists()):
+        write_file_atomic(meta_file, json_dumps(meta).encode("utf-8"))
+    _session_log = (session_name, list(conversation_history), meta)
+    return log_file
+
+def load_session(session_name: str) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Any]]]:
+    """Read a saved session as (history, meta), or None if it does not exist. Falls back to the legacy .json format."""
+    global _session_log
+    log_file, meta_file, plain_log_file, legacy_file = _session_files(session_name)
+    for candidate in (log_file, plain_log_file):
+        if not candidate.exists():
+            continue
+        meta = json_loads(meta_file.read_bytes()) if meta_file.exists() else {}
+        history = []
+        log_intact = True
+        with open(candidate, "rb", buffering=SESSION_READ_BUFFER) as raw, \
+                (gzip.GzipFile(fileobj=raw) if candidate is log_file else contextlib.nullcontext(raw)) as f:
+            try:
+                for line in f: # One message per line; no single huge string to parse
+                    if not line.strip():
+                        continue
+                    history.append(json_loads(line))
+            except (json.JSONDecodeError, EOFError, zlib.error, gzip.BadGzipFile):
+                console.print(f"[yellow]Warning: session log '{candidate}' ends in an incomplete entry; it was ignored.[/yellow]")
+                log_intact = False # Next save rewrites the log instead of appending after the torn entry
+        # An uncompressed log is never appended to; the next save rewrites it as .jsonl.gz
+        _session_log = (session_name, list(history), meta) if log_intact and candidate is log_file else None
+        return history, meta
+    if legacy_file.exists():
+        session_data = json_loads(legacy_file.read_bytes())
+        _session_log = None # Next save writes the JSONL format
+        return session_data.get("conversation_history", []), session_data
+    return None
+
 # --------------------------------------------------------------------------------
 # 8. Command Handling (New commands and modifications)
 # --------------------------------------------------------------------------------
+PROFILE_NAME_RE = re.compile(r"[A-Za-z0-9_]{1,64}") # Used with fullmatch
+MODEL_NAME_RE = re.compile(r"(?=.{3})[^/]*(?:/[^/]*)?", re.DOTALL) # At least 3 chars, at most one "/" (e.g. "anthropic/claude-3-opus")
+
 def handle_add_command_logic(path_to_add_str: str, is_auto_add: bool = False):
     """Logic for the /add command, callable by user and profile loading."""
     global conversation_history, config, current_workspace_root
@@ -1131,35 +1736,29 @@ def handle_add_command_logic(path_to_add_str: str, is_auto_add: bool = False):
     profile_settings = config.get("profiles", {}).get(current_profile_name, {})
     profile_ai_ignore = profile_settings.get("custom_ai_ignore")
 
-    ignore_patterns = get_ai_ignore_patterns(profile_ai_ignore)
-
     normalized_path_to_add = Path(normalize_path_str(path_to_add_str))
 
     if normalized_path_to_add.is_dir():
+        ignore_patterns = get_ai_ignore_patterns(profile_ai_ignore) # Only directory scans consult the ignore files
         add_directory_to_conversation(str(normalized_path_to_add), ignore_patterns)
     elif normalized_path_to_add.is_file():
         try:
-            if is_binary_file(str(normalized_path_to_add)):
+            stat_result = normalized_path_to_add.stat()
+            if _is_binary_cached(str(normalized_path_to_add), stat_result.st_mtime_ns, stat_result.st_size):
                 console.print(f"[yellow]Skipping binary file: {normalized_path_to_add}[/yellow]")
                 return
-            if normalized_path_to_add.stat().st_size > 5_000_000: # 5MB limit
+            if stat_result.st_size > 5_000_000: # 5MB limit
                 console.print(f"[yellow]Skipping file larger than 5MB: {normalized_path_to_add}[/yellow]")
                 return
 
             # Add to conversation history (ensure it's not already there)
-            file_marker_content_start = f"Content of file '{str(normalized_path_to_add)}':"
-            if any(msg.get("role") == "system" and msg.get("content","").startswith(file_marker_content_start) for msg in conversation_history):
+            if str(normalized_path_to_add) in file_context_index:
                 if not is_auto_add: # Don't print if auto-adding, too verbose
                     console.print(f"[dim]File '[cyan]{normalized_path_to_add}[/cyan]' is already in context.[/dim]")
                 return
 
             content = read_local_file(str(normalized_path_to_add))
-            conversation_history.append({
-                "role": "system",
-                "content": f"{file_marker_content_start}\n\n{content}",
-                "type": "file_context", # Mark for easier management
-                "path": str(normalized_path_to_add)
-            })
+            append_file_context(str(normalized_path_to_add), content)
             if not is_auto_add:
                 console.print(f"[bold green]✓[/bold green] Added file '[bright_cyan]{normalized_path_to_add}[/bright_cyan]' to conversation context.\n")
         except Exception as e:
@@ -1194,7 +1793,7 @@ def try_handle_slash_command(user_input: str) -> bool:
             return True
         new_model = args[0]
         # Basic validation: check if model string seems reasonable
-        if not (new_model and isinstance(new_model, str) and len(new_model.split('/')) <= 2 and len(new_model) > 2):
+        if not MODEL_NAME_RE.fullmatch(new_model):
             console.print(f"[red]Invalid model name format: {new_model}[/red]")
             return True
 
@@ -1205,19 +1804,14 @@ def try_handle_slash_command(user_input: str) -> bool:
         config["default_model"] = new_model # Update general default
         # Update current profile's model too
         profile_name = config.get("current_profile", "default")
-        if profile_name in config["profiles"]:
-            config["profiles"][profile_name]["model"] = new_model
-        else: # Should not happen if config is managed well
-            config["profiles"][profile_name] = DEFAULT_CONFIG["profiles"]["default"].copy()
-            config["profiles"][profile_name]["model"] = new_model
+        # Missing profile should not happen if config is managed well
+        profile = config.setdefault("profiles", {}).setdefault(profile_name, DEFAULT_CONFIG["profiles"]["default"].copy())
+        profile["model"] = new_model
 
         save_config(config)
         console.print(f"[green]Switched to model: [cyan]{current_llm_model}[/cyan][/green]")
-        # Update system prompt in history if it exists
-        for msg in conversation_history:
-            if msg["role"] == "system" and not msg.get("type"): # Main system prompt
-                msg["content"] = get_system_prompt()
-                break
+        # Update system prompt in history
+        refresh_main_system_prompt()
         return True
 
     elif command == "/save_session":
@@ -1225,18 +1819,9 @@ def try_handle_slash_command(user_input: str) -> bool:
             console.print("[red]Usage: /save_session <session_name>[/red]")
             return True
         session_name = args[0]
-        SESSION_DIR.mkdir(parents=True, exist_ok=True)
-        session_file = SESSION_DIR / f"{session_name}.json"
         try:
-            with open(session_file, "w") as f:
-                # Store relevant parts: history, current model, workspace root
-                session_data = {
-                    "conversation_history": conversation_history,
-                    "current_llm_model": current_llm_model,
-                    "current_workspace_root": str(current_workspace_root) if current_workspace_root else None,
-                    "version": "2.0" # For future compatibility
-                }
-                json.dump(session_data, f, indent=4)
+            # Store relevant parts: history, current model, workspace root
+            session_file = save_session(session_name)
             console.print(f"[green]Session saved as '[cyan]{session_name}[/cyan]' to {session_file}[/green]")
         except Exception as e:
             console.print(f"[red]Error saving session: {e}[/red]")
@@ -1247,19 +1832,19 @@ def try_handle_slash_command(user_input: str) -> bool:
             console.print("[red]Usage: /load_session <session_name>[/red]")
             # List available sessions
             if SESSION_DIR.exists():
-                sessions = [f.stem for f in SESSION_DIR.glob("*.json")]
+                sessions = list_saved_sessions()
                 if sessions:
                     console.print("Available sessions: " + ", ".join(f"[cyan]{s}[/cyan]" for s in sessions))
                 else:
                     console.print("No saved sessions found.")
             return True
         session_name = args[0]
-        session_file = SESSION_DIR / f"{session_name}.json"
-        if session_file.exists():
-            try:
-                with open(session_file, "r") as f:
-                    session_data = json.load(f)
-                conversation_history = session_data.get("conversation_history", [])
+        try:
+            loaded_session = load_session(session_name)
+            if loaded_session:
+                conversation_history, session_data = loaded_session
+                reset_file_context_index()
+                rebuild_file_context_index()
                 current_llm_model = session_data.get("current_llm_model", config.get("default_model"))
                 ws_root_str = session_data.get("current_workspace_root")
                 if ws_root_str:
@@ -1267,44 +1852,30 @@ def try_handle_slash_command(user_input: str) -> bool:
                 else:
                     current_workspace_root = None
 
-                # Ensure system prompt is up-to-date after loading
-                found_system_prompt = False
-                for msg in conversation_history:
-                    if msg["role"] == "system" and not msg.get("type"): # Main system prompt
-                        msg["content"] = get_system_prompt()
-                        found_system_prompt = True
-                        break
-                if not found_system_prompt and conversation_history: # Add if missing (e.g. old session format)
-                    conversation_history.insert(0, {"role": "system", "content": get_system_prompt()})
-                elif not conversation_history: # Empty history, add system prompt
-                     conversation_history.append({"role": "system", "content": get_system_prompt()})
-
+                # Ensure system prompt is up-to-date after loading (added if missing, e.g. old session format)
+                refresh_main_system_prompt()
 
                 console.print(f"[green]Session '[cyan]{session_name}[/cyan]' loaded.[/green]")
                 console.print(f"Model: [cyan]{current_llm_model}[/cyan], Workspace: [cyan]{current_workspace_root or 'Not set'}[/cyan]")
-            except Exception as e:
-                console.print(f"[red]Error loading session: {e}[/red]")
-        else:
-            console.print(f"[red]Session file not found: {session_file}[/red]")
+            else:
+                console.print(f"[red]Session not found: '{session_name}' in {SESSION_DIR}[/red]")
+        except Exception as e:
+            console.print(f"[red]Error loading session: {e}[/red]")
         return True
 
     elif command == "/list_context":
-        file_context_messages = [msg for msg in conversation_history if msg.get("type") == "file_context"]
-        if not file_context_messages:
+        if not file_context_index:
             console.print("[dim]No files are currently in the conversation context.[/dim]")
             return True
 
-        table = Table(title="Files in Context", show_lines=True, border_style="blue")
-        table.add_column("#", style="dim")
-        table.add_column("File Path", style="cyan")
-        table.add_column("Content Preview (lines)", style="green")
-
-        for i, msg in enumerate(file_context_messages):
+        table = _list_context_table()
+        for i, msg in enumerate(file_context_index.values(), 1): # Insertion order matches history order
             path = msg.get("path", "N/A")
-            content_preview = "\n".join(msg.get("content", "").splitlines()[:5]) # First 5 lines
-            if len(msg.get("content", "").splitlines()) > 5:
+            preview_lines, has_more = head_lines(msg.get("content", ""), 5) # First 5 lines
+            content_preview = "\n".join(preview_lines)
+            if has_more:
                 content_preview += "\n[dim]... (more content)[/dim]"
-            table.add_row(str(i+1), path, content_preview)
+            table.add_row(str(i), path, content_preview)
         console.print(table)
         return True
 
@@ -1314,28 +1885,22 @@ def try_handle_slash_command(user_input: str) -> bool:
             return True
 
         target_to_remove = " ".join(args) # Handle paths with spaces
-        file_context_messages = [msg for msg in conversation_history if msg.get("type") == "file_context"]
 
         removed = False
         try:
             # Try as index first
             idx_to_remove = int(target_to_remove) -1
-            if 0 <= idx_to_remove < len(file_context_messages):
-                msg_to_remove = file_context_messages[idx_to_remove]
-                conversation_history.remove(msg_to_remove)
-                console.print(f"[green]Removed '[cyan]{msg_to_remove.get('path', 'Unknown file')}[/cyan]' from context.[/green]")
+            if 0 <= idx_to_remove < len(file_context_index):
+                path_to_remove = next(itertools.islice(file_context_index, idx_to_remove, None))
+                remove_file_from_context(path_to_remove, quiet=True)
+                console.print(f"[green]Removed '[cyan]{path_to_remove}[/cyan]' from context.[/green]")
                 removed = True
             else:
                 console.print(f"[red]Invalid index: {target_to_remove}[/red]")
         except ValueError:
             # Try as path
             normalized_target_path = normalize_path_str(target_to_remove)
-            original_len = len(conversation_history)
-            conversation_history[:] = [
-                msg for msg in conversation_history
-                if not (msg.get("type") == "file_context" and msg.get("path") == normalized_target_path)
-            ]
-            if len(conversation_history) < original_len:
+            if remove_file_from_context(normalized_target_path, quiet=True):
                 console.print(f"[green]Removed '[cyan]{normalized_target_path}[/cyan]' from context.[/green]")
                 removed = True
 
@@ -1344,20 +1909,21 @@ def try_handle_slash_command(user_input: str) -> bool:
         return True
 
     elif command == "/clear_context":
-        original_len = len(conversation_history)
-        # Keep only the system prompt
-        conversation_history[:] = [msg for msg in conversation_history if msg["role"] == "system" and not msg.get("type")]
-        if not conversation_history: # Should not happen if initialized correctly
-            conversation_history.append({"role": "system", "content": get_system_prompt()})
+        # Keep only the system prompt: make sure it sits at index 0 (added if missing), then truncate in place
+        refresh_main_system_prompt()
+        had_more = len(conversation_history) > 1
+        del conversation_history[1:]
+        reset_file_context_index()
 
-        if len(conversation_history) < original_len:
+        if had_more:
              console.print("[green]All file contexts and chat history (except system prompt) cleared.[/green]")
         else:
             console.print("[dim]Context was already minimal or empty.[/dim]")
         return True
 
     elif command == "/config":
-        console.print(Panel(json.dumps(config, indent=2), title="Current Configuration", border_style="magenta"))
+        # Rendered from the dict (highlighted, and values are never parsed as console markup)
+        console.print(Panel(JSON.from_data(config, indent=2), title="Current Configuration", border_style="magenta"))
         console.print(f"Config file location: [dim]{CONFIG_FILE}[/dim]")
         return True
 
@@ -1378,17 +1944,15 @@ def try_handle_slash_command(user_input: str) -> bool:
             else:
                 console.print(f"[red]Error: '{prospective_root}' is not a valid directory.[/red]")
                 return True # Handled
+        _normalize_cached.cache_clear() # Entries keyed on the old root (set or unset) will not be hit again
 
         # Update config
-        profile_name = config.get("current_profile", "default")
-        if profile_name in config["profiles"]:
-            config["profiles"][profile_name]["workspace_root"] = str(current_workspace_root) if current_workspace_root else None
+        profile = config["profiles"].get(config.get("current_profile", "default"))
+        if profile is not None:
+            profile["workspace_root"] = str(current_workspace_root) if current_workspace_root else None
         save_config(config)
         # Update system prompt
-        for msg in conversation_history:
-            if msg["role"] == "system" and not msg.get("type"):
-                msg["content"] = get_system_prompt()
-                break
+        refresh_main_system_prompt()
         return True
 
     elif command == "/load_profile":
@@ -1397,18 +1961,20 @@ def try_handle_slash_command(user_input: str) -> bool:
             console.print("Available profiles: " + ", ".join(f"[cyan]{p}[/cyan]" for p in config.get("profiles", {}).keys()))
             return True
         profile_name_to_load = args[0]
+        if config_file_changed_externally(): # Pick up hand edits; otherwise the in-memory config is current
+            config = _read_config_file()
         if profile_name_to_load in config.get("profiles", {}):
             config["current_profile"] = profile_name_to_load
             save_config(config) # Save change to current_profile
-            # Reload config to apply the new profile settings (model, workspace, auto-add)
-            # This is a bit heavy but ensures all profile aspects are applied.
-            # Clear current history before loading profile settings like auto-add paths.
-            conversation_history.clear()
-            conversation_history.append({"role": "system", "content": get_system_prompt()}) # Add fresh system prompt
+            # Clear current history before applying profile settings like auto-add paths.
+            # Same list and system prompt message are kept (truncated in place, as in /clear_context); the prompt is refreshed once the model is set.
+            refresh_main_system_prompt()
+            del conversation_history[1:]
+            reset_file_context_index()
 
-            # load_config() will re-read from file and apply the new current_profile
-            # It also handles auto-adding paths.
-            load_config() # This will update global current_llm_model, current_workspace_root, and add files.
+            # Apply the in-memory profile (model, workspace, auto-add) without re-reading the config file
+            _apply_profile(config, profile_name_to_load)
+            refresh_main_system_prompt()
 
             console.print(f"[green]Profile '[cyan]{profile_name_to_load}[/cyan]' loaded.[/green]")
             console.print(f"Model: [cyan]{current_llm_model}[/cyan], Workspace: [cyan]{current_workspace_root or 'Not set'}[/cyan]")
@@ -1422,16 +1988,18 @@ def try_handle_slash_command(user_input: str) -> bool:
         else:
             profile_to_save_name = args[0]
 
-        if not profile_to_save_name.isalnum() or not profile_to_save_name: # Basic validation
-            console.print("[red]Invalid profile name. Use alphanumeric characters.[/red]")
+        if not PROFILE_NAME_RE.fullmatch(profile_to_save_name): # Basic validation
+            console.print("[red]Invalid profile name. Use letters, digits and underscores (up to 64).[/red]")
             return True
 
+        profiles = config["profiles"]
+        existing_profile = profiles.get(profile_to_save_name, {})
         current_settings = {
             "model": current_llm_model,
             "workspace_root": str(current_workspace_root) if current_workspace_root else None,
             # For auto_add_paths, we could ask the user or try to infer from current context
-            "auto_add_paths": config["profiles"].get(profile_to_save_name, {}).get("auto_add_paths", []), # Keep existing or prompt
-            "custom_ai_ignore": config["profiles"].get(profile_to_save_name, {}).get("custom_ai_ignore", None) # Keep existing
+            "auto_add_paths": existing_profile.get("auto_add_paths", []), # Keep existing or prompt
+            "custom_ai_ignore": existing_profile.get("custom_ai_ignore", None) # Keep existing
         }
         # Prompt for auto_add_paths and custom_ai_ignore if desired
         if Confirm.ask(f"Update auto-added paths for profile '{profile_to_save_name}'?"):
@@ -1443,7 +2011,7 @@ def try_handle_slash_command(user_input: str) -> bool:
              current_settings["custom_ai_ignore"] = ignore_path_str if ignore_path_str else None
 
 
-        config["profiles"][profile_to_save_name] = current_settings
+        profiles[profile_to_save_name] = current_settings
         config["current_profile"] = profile_to_save_name # Switch to it if newly saved
         save_config(config)
         console.print(f"[green]Settings saved to profile '[cyan]{profile_to_save_name}[/cyan]'.[/green]")
@@ -1455,20 +2023,38 @@ def try_handle_slash_command(user_input: str) -> bool:
 
     return False # Not a known slash command
 
-def remove_file_from_context(normalized_file_path: str, quiet: bool = False):
-    """Removes a specific file's content from conversation history."""
-    global conversation_history
-    initial_len = len(conversation_history)
-    # Remove based on the 'path' stored in the message
-    conversation_history[:] = [
-        msg for msg in conversation_history
-        if not (msg.get("type") == "file_context" and msg.get("path") == normalized_file_path)
-    ]
-    if not quiet and len(conversation_history) < initial_len:
+def remove_file_from_context(normalized_file_path: str, quiet: bool = False) -> bool:
+    """Removes a specific file's content from conversation history. Returns True if it was in context."""
+    msg = file_context_index.get(normalized_file_path) # Looked up via the index instead of scanning for the path
+    if msg is None:
+        return False
+    conversation_history.remove(msg) # Identity hit; no list rebuild
+    forget_file_context(normalized_file_path)
+    if not quiet:
         console.print(f"[dim]Updated context: Removed old version of '{normalized_file_path}'.[/dim]")
+    return True
+
 
+_LIST_CONTEXT_COLUMNS = ( # (header, style)
+    ("#", "dim"),
+    ("File Path", "cyan"),
+    ("Content Preview (lines)", "green"),
+)
+
+def _list_context_table() -> Table:
+    """Empty /list_context table built from the column specs."""
+    table = Table(title="Files in Context", show_lines=True, border_style="blue")
+    for header, style in _LIST_CONTEXT_COLUMNS:
+        table.add_column(header, style=style)
+    return table
 
 def print_help():
+    console.print(_help_panel())
+
+@functools.cache
+def _help_panel() -> Panel:
+    """The /help panel; only module constants are interpolated, so it is built (and Markdown-parsed) once."""
+    from rich.markdown import Markdown
     help_text = f"""
 [bold bright_blue]AI Code Assistant Commands:[/bold bright_blue]
 
@@ -1502,7 +2088,25 @@ def print_help():
 [bold bright_blue]Default Ignore File Example:[/bold bright_blue] [dim]{AI_IGNORE_EXAMPLE_FILE}[/dim]
  (or create `.ai_ignore` in your current working directory)
     """
-    console.print(Panel(Markdown(help_text), title="Help", border_style="blue", expand=False))
+    return Panel(Markdown(help_text), title="Help", border_style="blue", expand=False)
+
+
+@functools.cache
+def _welcome_panel(model: str, workspace: str) -> Panel:
+    """The startup banner; cached on the only two values it shows."""
+    welcome_text = f"""[bold bright_blue]🐋 AI Code Assistant v2.0[/bold bright_blue]
+[dim][blue]Powered by LiteLLM ([underline][link=https://litellm.ai/]https://litellm.ai/[/link][/underline])[/blue][/dim]
+Current Model: [bright_cyan]{model}[/bright_cyan]
+Workspace: [bright_cyan]{workspace}[/bright_cyan]
+Type [bold cyan]/help[/bold cyan] for commands."""
+
+    return Panel.fit(
+        welcome_text,
+        border_style="bright_blue",
+        padding=(1, 2),
+        title="[bold bright_cyan]🤖 AI Code Assistant[/bold bright_cyan]",
+        title_align="center"
+    )
 
 
 # --------------------------------------------------------------------------------
@@ -1515,28 +2119,15 @@ def main():
     config = load_config()
 
     # Initialize conversation history with the system prompt
-    if not conversation_history or not any(msg["role"] == "system" and not msg.get("type") for msg in conversation_history):
-        conversation_history.insert(0, {"role": "system", "content": get_system_prompt()})
+    refresh_main_system_prompt()
 
     # Welcome panel
-    welcome_text = f"""[bold bright_blue]🐋 AI Code Assistant v2.0[/bold bright_blue]
-[dim][blue]Powered by LiteLLM ([underline][link=https://litellm.ai/]https://litellm.ai/[/link][/underline])[/blue][/dim]
-Current Model: [bright_cyan]{current_llm_model}[/bright_cyan]
-Workspace: [bright_cyan]{current_workspace_root or 'Not set'}[/bright_cyan]
-Type [bold cyan]/help[/bold cyan] for commands."""
-
-    console.print(Panel.fit(
-        welcome_text,
-        border_style="bright_blue",
-        padding=(1, 2),
-        title="[bold bright_cyan]🤖 AI Code Assistant[/bold bright_cyan]",
-        title_align="center"
-    ))
+    console.print(_welcome_panel(current_llm_model, str(current_workspace_root or 'Not set')))
     console.print()
 
     while True:
         try:
-            user_input_raw = prompt_session.prompt("🔵 You> ").strip()
+            user_input_raw = get_prompt_session().prompt("🔵 You> ").strip()
         except (EOFError, KeyboardInterrupt):
             console.print("\n[bold yellow]👋 Exiting gracefully...[/bold yellow]")
             break
@@ -1561,5 +2152,6 @@ Type [bold cyan]/help[/bold cyan] for commands."""
     console.print("[bold blue]✨ Session finished. Thank you for using AI Code Assistant![/bold blue]")
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
     load_dotenv() # Load .env file for API keys if present (LiteLLM will pick them up)
     main()
@@ -0,0 +1,121 @@
+# backend/cache.py
+import logging
+import time
+from collections import OrderedDict
+
+try:
+    import redis.asyncio as redis_asyncio  # Optional: shared store for multi-worker deployments
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+LISTING_TTL_SECONDS = 45  # Folder listings may lag changes made outside this app (e.g. in the Drive UI) by this much
+LOCAL_CACHE_MAX_LISTINGS = 10_000
+LISTING_GENERATION_TTL_SECONDS = 24 * 60 * 60  # Outlives any listing cached under an older generation
+# With a shared store, other workers may update an entry at any time, so the local copy is only trusted briefly
+SHARED_LOCAL_CACHE_TTL_SECONDS = 5
+
+_redis_clients: dict = {}
+
+
+def redis_from_url(redis_url: str | None):
+    """Shared async Redis client (one connection pool per URL), or None if Redis is not configured or not installed."""
+    if not redis_url:
+        return None
+    if redis_asyncio is None:
+        logger.warning("REDIS_URL is set but the redis package is not installed; caches stay in-process.")
+        return None
+    client = _redis_clients.get(redis_url)
+    if client is None:
+        client = _redis_clients[redis_url] = redis_asyncio.from_url(redis_url)
+    return client
+
+
+class LocalTTLCache:
+    """Bounded in-process LRU whose entries expire after a TTL."""
+
+    def __init__(self, ttl: int, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key: str, extend: bool = False):
+        """Value for key, or None if absent or expired. extend=True restarts the entry's TTL (sliding expiry)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        if extend:
+            self._entries[key] = (now + self.ttl, entry[1])
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+
+class ListingCache:
+    """
+    Serialized folder-listing pages (the exact response bytes), kept for a short TTL.
+
+    Keys (see key()) include a per-session generation number; bumping the generation on any write invalidates
+    every cached page of that session at once, without scanning for keys. The generation is kept under its own
+    key, not in the session, so bumping it never rewrites (and races with) other session data.
+    """
+
+    def __init__(self, redis_url: str | None = None, ttl: int = LISTING_TTL_SECONDS, max_local: int = LOCAL_CACHE_MAX_LISTINGS):
+        self.ttl = ttl
+        self._local = LocalTTLCache(ttl, max_local)
+        self._redis = redis_from_url(redis_url)
+        generation_ttl = LISTING_GENERATION_TTL_SECONDS if self._redis is None else SHARED_LOCAL_CACHE_TTL_SECONDS
+        self._local_generations = LocalTTLCache(generation_ttl, max_local)
+
+    async def _generation(self, session_id: str) -> int:
+        generation = self._local_generations.get(session_id)
+        if generation is not None or self._redis is None:
+            return generation or 0
+        raw = await self._redis.get(f"listing_gen:{session_id}")
+        generation = int(raw) if raw is not None else 0
+        self._local_generations.set(session_id, generation)
+        return generation
+
+    async def key(self, session_id: str, *parts) -> str:
+        """Cache key for one listing page of a session, under its current generation."""
+        return ":".join((session_id, str(await self._generation(session_id)), *map(str, parts)))
+
+    async def invalidate_session(self, session_id: str):
+        """Move a session on to a new generation, so none of its cached pages are served again."""
+        if self._redis is None:
+            self._local_generations.set(session_id, (self._local_generations.get(session_id) or 0) + 1)
+            return
+        generation_key = f"listing_gen:{session_id}"
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.incr(generation_key)
+        pipe.expire(generation_key, LISTING_GENERATION_TTL_SECONDS)
+        generation, _ = await pipe.execute()
+        self._local_generations.set(session_id, generation)
+
+    async def get(self, key: str) -> bytes | None:
+        body = self._local.get(key)
+        if body is not None or self._redis is None:
+            return body
+        body = await self._redis.get(f"listing:{key}")
+        if body is not None:
+            self._local.set(key, body)
+        return body
+
+    async def set(self, key: str, body: bytes):
+        self._local.set(key, body)
+        if self._redis is not None:
+            await self._redis.set(f"listing:{key}", body, ex=self.ttl)
@@ -1,5 +1,6 @@
 # backend/config.py
 import os
+import secrets
 
 # In a real application, these would be loaded from environment variables or a secure config service
 # For this subtask, we'll use placeholder values.
@@ -18,3 +19,9 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.metadata.readonly',
     'https://www.googleapis.com/auth/drive.file', # More comprehensive scope for r/w
 ]
+
+# Signs the session cookie. Set it explicitly when running several workers, or each one signs with its own random key.
+SESSION_SECRET_IS_SHARED = bool(os.environ.get("SESSION_SECRET")) # False: this process made up its own key
+SESSION_SECRET = os.environ.get("SESSION_SECRET") or secrets.token_hex(32)
+# Optional shared session store (requires the redis package); without it sessions are kept in-process.
+REDIS_URL = os.environ.get("REDIS_URL")
@@ -1,28 +1,95 @@
 # backend/logging_config.py
+import atexit
+import contextvars
+import copy
+import dataclasses
 import logging
+import logging.handlers
 import json
-from datetime import datetime
+import queue
+import time
+from json.encoder import encode_basestring  # C string escaper used by json.dumps
+
+try:
+    import orjson  # C encoder; this formatter runs on every log record
+except ImportError:
+    orjson = None
+
+# ID of the HTTP request being handled (set by the request middleware). Worker threads started with
+# anyio.to_thread inherit it, so Drive calls made on behalf of a request are tagged with its ID too.
+request_id_var: contextvars.ContextVar[str | None] = contextvars.ContextVar("request_id", default=None)
+
+def _props_json(props) -> str:
+    """JSON object for a record's props: a dict or a dataclass instance (orjson encodes dataclasses natively)."""
+    if orjson:
+        return orjson.dumps(props).decode()
+    return json.dumps(props if isinstance(props, dict) else dataclasses.asdict(props))
+
+def _json_str(value) -> str:
+    """JSON for a string field that may be None (e.g. funcName of a hand-built record)."""
+    return "null" if value is None else encode_basestring(str(value))
 
 class JsonFormatter(logging.Formatter):
+    # (whole second, its "YYYY-MM-DDTHH:MM:SS" string); records logged within the same second reuse it.
+    # Swapped as one tuple so concurrent handlers never see a mismatched pair.
+    _last_second = (None, "")
+
+    def format_timestamp(self, created: float) -> str:
+        """UTC ISO-8601 timestamp with microseconds, without building a datetime per record."""
+        second = int(created)
+        cached_second, second_str = self._last_second
+        if second != cached_second:
+            second_str = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+            self._last_second = (second, second_str)
+        return f"{second_str}.{int((created - second) * 1_000_000):06d}Z"
+
     def format(self, record):
-        log_record = {
-            "timestamp": datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
-            "level": record.levelname,
-            "message": record.getMessage(),
-            "module": record.module,
-            "funcName": record.funcName,
-            "lineno": record.lineno,
-        }
-        if hasattr(record, 'props') and record.props:
-            log_record.update(record.props)
+        # The line is written directly: the fixed fields as an f-string, then props (a dict, or a dataclass on hot
+        # paths) encoded on their own and spliced in, so no merged dict is built per record
+        line = (
+            f'{{"timestamp":"{self.format_timestamp(record.created)}"'
+            f',"level":{_json_str(record.levelname)}'
+            f',"message":{_json_str(record.getMessage())}'
+            f',"module":{_json_str(record.module)}'
+            f',"funcName":{_json_str(record.funcName)}'
+            f',"lineno":{int(record.lineno)}'
+        )
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            line += ',"request_id":' + _json_str(request_id)
+        props = getattr(record, 'props', None)
+        if props:
+            props_json = _props_json(props)
+            if props_json != "{}":
+                line += "," + props_json[1:-1]
 
         # Include exception info if present
         if record.exc_info:
-            log_record['exc_info'] = self.formatException(record.exc_info)
+            line += ',"exc_info":' + _json_str(self.formatException(record.exc_info))
+        elif record.exc_text: # Already rendered by QueueLogHandler.prepare
+            line += ',"exc_info":' + _json_str(record.exc_text)
         if record.stack_info:
-            log_record['stack_info'] = self.formatStack(record.stack_info)
+            line += ',"stack_info":' + _json_str(self.formatStack(record.stack_info))
+        return line + "}"
 
-        return json.dumps(log_record)
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a background QueueListener, so request handlers never block on the stream write.
+    Only what depends on the logging thread is resolved here (message args, traceback, request ID);
+    JSON encoding and the write happen on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None # Tracebacks hold frames; do not keep them alive in the queue
+        record.request_id = request_id_var.get()
+        return record
+
+_listener = None
 
 def setup_logging():
     logger = logging.getLogger() # Get root logger
@@ -32,16 +99,31 @@ def setup_logging():
     if logger.hasHandlers():
         logger.handlers.clear()
 
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
     handler = logging.StreamHandler() # Output to stdout/stderr
     formatter = JsonFormatter()
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueLogHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
     logger.setLevel(logging.INFO) # Set default level
 
+    atexit.register(_stop_listener) # Flush queued records on shutdown
+
     # Optionally, silence overly verbose loggers from libraries
     # logging.getLogger("uvicorn.access").setLevel(logging.WARNING) # Example
     # logging.getLogger("googleapiclient.discovery_cache").setLevel(logging.WARNING)
 
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 # Example of how to get a configured logger instance (not strictly needed if root logger is used)
 # def get_logger(name: str):
 #     logger = logging.getLogger(name)
@@ -1,26 +1,50 @@
 # backend/main.py
 from fastapi import FastAPI, Request as FastAPIRequest, HTTPException, UploadFile, File, Form, Query, Path
 # Renamed Request to FastAPIRequest to avoid conflict with GoogleAuthRequest
-from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from typing import Literal, NoReturn
 from pydantic import BaseModel, Field
+from starlette.datastructures import URL, Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleAuthRequest
-from googleapiclient.discovery import build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
+from googleapiclient.http import HttpRequest, MediaIoBaseDownload, MediaIoBaseUpload, MediaUpload
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
+from functools import lru_cache
 import io
+from dataclasses import dataclass
+import threading
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+import hashlib
+import re
+import uuid
 import logging # Import logging
-from .logging_config import setup_logging # Import setup_logging
+import anyio
+from .logging_config import request_id_var, setup_logging # Import setup_logging
+from .cache import ListingCache, LocalTTLCache
+from .sessions import SESSION_COOKIE_MAX_AGE_SECONDS, SESSION_COOKIE_NAME, SessionStore, new_session_id, sign_session_id, unsign_session_id
 
 # Call setup_logging() to configure logging for the application
 setup_logging()
 
 # Get a logger instance for this module
 logger = logging.getLogger(__name__)
+# LogRequestsMiddleware already logs every request as structured JSON; uvicorn's own access log would
+# duplicate it (and cost throughput), so silence it however the app is launched (uvicorn, gunicorn, ...)
+logging.getLogger("uvicorn.access").disabled = True
 
 # --- Pydantic Models (from previous step, ensure they are here) ---
 class MessageResponse(BaseModel):
@@ -53,6 +77,8 @@ class DriveFile(BaseModel):
     iconLink: str | None = Field(None, description="Link to file's icon")
     webViewLink: str | None = Field(None, description="Link to view in browser")
     webContentLink: str | None = Field(None, description="Link to download content")
+    thumbnailLink: str | None = Field(None, description="Short-lived link to a thumbnail (listings only)")
+    capabilities: dict[str, bool] | None = Field(None, description="What the user may do with the item: canEdit, canRename, canDelete (listings only)")
 class FileListResponse(BaseModel):
     items: list[DriveFile] = Field(..., description="List of files and folders.")
     nextPageToken: str | None = Field(None, description="Token for next page.")
@@ -70,6 +96,21 @@ class DownloadSimulatedResponse(BaseModel):
     name: str | None = Field(None)
     file_id: str | None = Field(None)
     webViewLink: str | None = Field(None)
+class BatchCall(BaseModel):
+    op: Literal["get", "delete", "rename"] = Field(..., description="Operation to run on the file.")
+    fileId: str = Field(..., description="Google Drive File ID")
+    fields: str | None = Field(None, description="Fields to return for 'get'.", example="id, name, mimeType")
+    name: str | None = Field(None, description="New name for 'rename'.")
+class BatchRequest(BaseModel):
+    calls: list[BatchCall] = Field(..., min_length=1, max_length=100, description="Up to 100 metadata calls, sent to Drive as one batch request.")
+class BatchCallResult(BaseModel):
+    fileId: str = Field(..., description="Google Drive File ID the call targeted")
+    ok: bool = Field(..., description="Whether the call succeeded")
+    data: dict | None = Field(None, description="Response body of a successful call")
+    status: int | None = Field(None, description="HTTP status of a failed call")
+    error: str | None = Field(None, description="Error message of a failed call")
+class BatchResponse(BaseModel):
+    results: list[BatchCallResult] = Field(..., description="One result per call, in request order.")
 
 from . import config
 
@@ -83,49 +124,225 @@ app = FastAPI(
 
 logger.info("Application starting up...", extra={"props": {"app_title": app.title, "app_version": app.version}})
 
-user_sessions = {}
+# Per-browser session data (credentials) and pending OAuth states, keyed by a signed session cookie; see sessions.py
+session_store = SessionStore(config.REDIS_URL)
+
+def request_session_id(request: FastAPIRequest) -> str | None:
+    return unsign_session_id(request.cookies.get(SESSION_COOKIE_NAME), config.SESSION_SECRET)
+
+async def request_session(request: FastAPIRequest) -> tuple[str | None, dict]:
+    """(session_id, session data) for the caller; data is empty if there is no valid session yet."""
+    session_id = request_session_id(request)
+    session = await session_store.get(session_id) if session_id else None
+    return session_id, (session if session is not None else {})
+
+# Folder listings, cached per session; see listing_cache_key / invalidate_listings
+listing_cache = ListingCache(config.REDIS_URL)
+
+# Both only need the session ID from the (signed) cookie, so neither reads the session itself again
+async def listing_cache_key(request: FastAPIRequest, folder_id: str, page_size: int, details: bool) -> str | None:
+    session_id = request_session_id(request)
+    return await listing_cache.key(session_id, folder_id, page_size, int(details)) if session_id else None
+
+async def invalidate_listings(request: FastAPIRequest):
+    """Drop the caller's cached listings after a change made through this app, by moving on to a new key generation."""
+    session_id = request_session_id(request)
+    if session_id:
+        await listing_cache.invalidate_session(session_id)
+
+# googleapiclient is synchronous: every .execute() / next_chunk() is a blocking HTTPS round-trip.
+# Endpoints run them in worker threads so one slow Drive call does not stall the event loop. Drive calls get their own
+# limiter so they cannot starve Starlette's default thread pool (UploadFile I/O, sync dependencies).
+DRIVE_CALL_LIMITER = anyio.CapacityLimiter(32)
+
+async def run_drive_call(func, *args):
+    """Run a blocking Drive API call in a worker thread."""
+    return await anyio.to_thread.run_sync(func, *args, limiter=DRIVE_CALL_LIMITER)
+
+# A service built per request would open (and TLS-handshake) a new connection to googleapis.com each time. Instead,
+# requests execute over the current worker thread's httplib2.Http, which keeps its connections alive across requests.
+# httplib2.Http is not thread-safe, hence one per thread rather than one per process.
+DRIVE_HTTP_TIMEOUT = 30 # seconds
+DRIVE_NUM_RETRIES = 3 # Exponential backoff on 429/5xx and rate-limit 403s; not applied to POST (not idempotent)
+_thread_state = threading.local()
+
+def thread_authorized_http(credentials: Credentials) -> AuthorizedHttp:
+    http = getattr(_thread_state, "http", None)
+    if http is None:
+        http = _thread_state.http = httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT)
+    return AuthorizedHttp(credentials, http=http)
+
+def execute_drive_request(request):
+    """Execute a Drive API request (blocking) over this thread's keep-alive connection, retrying transient errors."""
+    if not isinstance(request, HttpRequest): # MockDriveService
+        return request.execute()
+    num_retries = 0 if request.method == "POST" else DRIVE_NUM_RETRIES
+    return request.execute(http=thread_authorized_http(request.http.credentials), num_retries=num_retries)
+
+async def run_drive_request(request):
+    return await run_drive_call(execute_drive_request, request)
+
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # Resumable upload chunk; memory per upload stays at this size, not the file size
+UPLOAD_STREAM_BUFFER = 16 # Request body pieces queued ahead of the upload thread before the client is back-pressured
+
+class StreamedMediaUpload(MediaUpload):
+    """
+    Resumable upload of unknown size fed from the request body. The event loop pushes body pieces into an anyio
+    memory stream; the upload thread pulls them as next_chunk() asks for bytes. A short read marks the last chunk.
+    An exception pushed into the stream aborts the upload instead of finalizing a truncated file.
+    """
+
+    def __init__(self, receive_stream, mimetype: str, chunksize: int = UPLOAD_CHUNK_SIZE):
+        super().__init__()
+        self._receive_stream = receive_stream
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray() # Current chunk; kept until Drive acknowledges it, in case it has to be resent
+        self._buffer_start = 0 # Upload offset of _buffer[0]
+        self._eof = False
+        self.bytes_received = 0
+
+    def chunksize(self): return self._chunksize
+    def mimetype(self): return self._mimetype
+    def size(self): return None
+    def resumable(self): return True
+    def has_stream(self): return False
+
+    def getbytes(self, begin, length):
+        del self._buffer[:begin - self._buffer_start]
+        self._buffer_start = begin
+        while len(self._buffer) < length and not self._eof:
+            try:
+                piece = anyio.from_thread.run(self._receive_stream.receive)
+            except anyio.EndOfStream:
+                self._eof = True
+                break
+            if isinstance(piece, Exception):
+                raise piece
+            self._buffer += piece
+            self.bytes_received += len(piece)
+        return bytes(self._buffer[:length])
 
 # --- Middleware for Logging Requests ---
-@app.middleware("http")
-async def log_requests_middleware(request: FastAPIRequest, call_next):
-    client_host = request.client.host if request.client else "unknown"
-    # Reducing header verbosity for logs; log specific headers if needed.
-    # For example, only 'user-agent' and 'content-type'.
-    relevant_headers = {
-        "user-agent": request.headers.get("user-agent"),
-        "content-type": request.headers.get("content-type"),
-        "accept": request.headers.get("accept"),
-    }
-    extra_props = {
-        "method": request.method,
-        "url": str(request.url),
-        "client_host": client_host,
-        "headers": relevant_headers
-    }
-    logger.info("Incoming request", extra={"props": extra_props})
-
-    response = await call_next(request)
-
-    extra_props_resp = {
-        "method": request.method,
-        "url": str(request.url),
-        "status_code": response.status_code
-    }
-    logger.info("Request finished", extra={"props": extra_props_resp})
-    return response
+# Pure ASGI middleware: @app.middleware("http") (BaseHTTPMiddleware) builds a Request/Response pair and
+# runs the endpoint in a separate task for every request, which costs a large share of throughput.
+# Props of the two records logged for every request. Slotted dataclasses are cheaper to build than nested dicts,
+# and JsonFormatter encodes them directly (see logging_config._props_json).
+@dataclass(slots=True)
+class RequestLogProps:
+    method: str
+    url: str
+    client_host: str
+    headers: dict
+
+@dataclass(slots=True)
+class ResponseLogProps:
+    method: str
+    url: str
+    status_code: int
+
+REQUEST_ID_HEADER = "x-request-id"
+REQUEST_ID_MAX_LENGTH = 128
+UNLOGGED_PATHS = frozenset({"/", "/api/status"}) # Health checks; logging them only adds noise and cost
+
+def incoming_request_id(scope: Scope) -> str:
+    """The caller's X-Request-ID (so traces join up across services), or a new one."""
+    request_id = Headers(scope=scope).get(REQUEST_ID_HEADER)
+    if request_id and len(request_id) <= REQUEST_ID_MAX_LENGTH and request_id.isprintable():
+        return request_id
+    return uuid.uuid4().hex
+
+class LogRequestsMiddleware:
+    """Tags each request with an ID (echoed as X-Request-ID and added to its log records) and logs its start and end."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = incoming_request_id(scope)
+        request_id_header = (REQUEST_ID_HEADER.encode(), request_id.encode())
+        token = request_id_var.set(request_id)
+        try:
+            await self._call(scope, receive, send, request_id_header)
+        finally:
+            request_id_var.reset(token)
+
+    async def _call(self, scope: Scope, receive: Receive, send: Send, request_id_header: tuple[bytes, bytes]):
+        async def send_with_request_id(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), request_id_header]
+            await send(message)
+
+        # Nothing below is needed unless the records are emitted
+        if not logger.isEnabledFor(logging.INFO) or scope["path"] in UNLOGGED_PATHS:
+            await self.app(scope, receive, send_with_request_id)
+            return
+
+        client = scope.get("client")
+        client_host = client[0] if client else "unknown"
+        url = str(URL(scope=scope))
+        # Reducing header verbosity for logs; log specific headers if needed.
+        # For example, only 'user-agent' and 'content-type'.
+        headers_get = Headers(scope=scope).get
+        relevant_headers = {
+            "user-agent": headers_get("user-agent"),
+            "content-type": headers_get("content-type"),
+            "accept": headers_get("accept"),
+        }
+        logger.info("Incoming request", extra={"props": RequestLogProps(scope["method"], url, client_host, relevant_headers)})
+
+        status_code = 500 # If the app fails before starting a response, the server answers 500
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send_with_request_id(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        logger.info("Request finished", extra={"props": ResponseLogProps(scope["method"], url, status_code)})
+
+app.add_middleware(LogRequestsMiddleware)
+# Listings are repetitive JSON (long links, repeated keys) and shrink several-fold. Level 5 gets most of level 9's ratio
+# for a fraction of the CPU. Downloads opt out by declaring Content-Encoding: identity (file bytes are often compressed
+# already, and compressing would drop their Content-Length).
+app.add_middleware(GZipMiddleware, minimum_size=512, compresslevel=5)
 
 # --- Authentication Endpoints ---
+OAUTH_CLIENT_CONFIG = { "web": { "client_id": config.GOOGLE_CLIENT_ID, "client_secret": config.GOOGLE_CLIENT_SECRET, "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token", "redirect_uris": [config.GOOGLE_REDIRECT_URI], "javascript_origins": ["http://localhost:3000"] }}
+OAUTH_SCOPES = tuple(config.SCOPES)
+
+# Token exchanges and refreshes go to oauth2.googleapis.com over one shared connection pool, rather than a fresh
+# TCP + TLS handshake (and a socket left in TIME_WAIT) per call. HTTPAdapter pools are thread-safe.
+GOOGLE_AUTH_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+GOOGLE_AUTH_SESSION = requests.Session()
+GOOGLE_AUTH_SESSION.mount("https://", GOOGLE_AUTH_ADAPTER)
+GOOGLE_AUTH_REQUEST = GoogleAuthRequest(session=GOOGLE_AUTH_SESSION) # Transport for credentials.refresh()
+
+def new_oauth_flow() -> Flow:
+    # A Flow is not cached or shared: it holds per-login state (its OAuth2Session's state and the PKCE code
+    # verifier), so concurrent logins must not reuse one. Only the client config and scopes are built once,
+    # and every flow's session borrows the shared connection pool.
+    flow = Flow.from_client_config(client_config=OAUTH_CLIENT_CONFIG, scopes=OAUTH_SCOPES, redirect_uri=config.GOOGLE_REDIRECT_URI)
+    flow.oauth2session.mount("https://", GOOGLE_AUTH_ADAPTER)
+    return flow
+
 @app.get("/api/auth/login/google", summary="Initiate Google OAuth 2.0 Login", tags=["Authentication"])
 async def login_google(request: FastAPIRequest): # Changed 'Request' to 'FastAPIRequest'
     logger.info("Initiating Google OAuth 2.0 login flow.")
-    flow = Flow.from_client_config(
-        client_config={ "web": { "client_id": config.GOOGLE_CLIENT_ID, "client_secret": config.GOOGLE_CLIENT_SECRET, "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token", "redirect_uris": [config.GOOGLE_REDIRECT_URI], "javascript_origins": ["http://localhost:3000"] }},
-        scopes=config.SCOPES, redirect_uri=config.GOOGLE_REDIRECT_URI
-    )
+    flow = new_oauth_flow()
     authorization_url, state = flow.authorization_url(access_type='offline', include_granted_scopes='true')
-    user_sessions['oauth_state'] = state
+    session_id = request_session_id(request) or new_session_id()
+    await session_store.set_oauth_state(session_id, state)
     logger.info("Generated authorization URL and state for CSRF.", extra={"props": {"auth_url_domain": authorization_url.split('/')[2], "state_len": len(state)}})
-    return RedirectResponse(authorization_url)
+    response = RedirectResponse(authorization_url)
+    # Lax (not Strict) so the cookie comes back on Google's top-level redirect to the callback
+    response.set_cookie(SESSION_COOKIE_NAME, sign_session_id(session_id, config.SESSION_SECRET), max_age=SESSION_COOKIE_MAX_AGE_SECONDS, httponly=True, samesite="lax")
+    return response
 
 @app.get("/api/auth/callback/google", response_model=AuthCallbackResponse, summary="Google OAuth 2.0 Callback", tags=["Authentication"])
 async def auth_callback_google(
@@ -134,21 +351,24 @@ async def auth_callback_google(
     state: str = Query(..., description="CSRF state token from Google.")
 ):
     logger.info("Received callback from Google OAuth.", extra={"props": {"has_code": bool(code), "received_state_len": len(state)}})
-    stored_state = user_sessions.get('oauth_state')
+    session_id, session = await request_session(request)
+    stored_state = await session_store.pop_oauth_state(session_id) if session_id else None # Consumed: one callback per login
     if not stored_state or stored_state != state:
         logger.warning("Invalid CSRF state token.", extra={"props": {"expected_state": stored_state, "received_state": state}})
         raise HTTPException(status_code=400, detail="Invalid CSRF state token.")
-    user_sessions.pop('oauth_state', None)
     logger.info("CSRF state token verified successfully.")
     try:
-        flow = Flow.from_client_config(client_config={ "web": { "client_id": config.GOOGLE_CLIENT_ID, "client_secret": config.GOOGLE_CLIENT_SECRET, "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token", "redirect_uris": [config.GOOGLE_REDIRECT_URI], }}, scopes=config.SCOPES, redirect_uri=config.GOOGLE_REDIRECT_URI)
+        flow = new_oauth_flow()
         logger.info("Simulating token fetch with authorization code.", extra={"props": {"code_len": len(code)}})
         # Actual token fetch is commented out for simulation
         # flow.fetch_token(code=code)
         # credentials = flow.credentials
         credentials_dict_data = {'token': 'dummy_access_token', 'refresh_token': 'dummy_refresh_token', 'token_uri': 'https://oauth2.googleapis.com/token', 'client_id': config.GOOGLE_CLIENT_ID, 'client_secret': config.GOOGLE_CLIENT_SECRET, 'scopes': config.SCOPES }
         credentials = Credentials.from_authorized_user_info(credentials_dict_data)
-        user_sessions['credentials'] = credentials_to_dict(credentials)
+        credentials.expiry = utcnow() + SIMULATED_TOKEN_LIFETIME # A real fetch_token sets this from expires_in
+        session['credentials'] = credentials_to_dict(credentials)
+        await session_store.set(session_id, session)
+        keep_token_fresh(session_id)
         logger.info("Successfully (simulated) fetched and stored credentials.", extra={"props": {"scopes_granted": credentials.scopes}})
         return AuthCallbackResponse(message="Authentication successful (simulated).", credentials=CredentialsModel(**credentials_dict_data))
     except Exception as e:
@@ -156,12 +376,14 @@ async def auth_callback_google(
         raise HTTPException(status_code=500, detail=f"Authentication failed: {str(e)}")
 
 def credentials_to_dict(credentials: Credentials) -> dict:
-    return {'token': credentials.token, 'refresh_token': credentials.refresh_token, 'token_uri': credentials.token_uri, 'client_id': credentials.client_id, 'client_secret': credentials.client_secret, 'scopes': credentials.scopes, 'id_token': getattr(credentials, 'id_token', None)}
+    # Runs once per login or token refresh (Credentials are rebuilt per request), so there is nothing worth caching
+    return {'token': credentials.token, 'refresh_token': credentials.refresh_token, 'token_uri': credentials.token_uri, 'client_id': credentials.client_id, 'client_secret': credentials.client_secret, 'scopes': credentials.scopes, 'id_token': credentials.id_token, 'expiry': credentials.expiry.isoformat() + "Z" if credentials.expiry else None}
 
 @app.get("/api/me", response_model=UserProfileResponse, summary="Check Authentication Status", tags=["Authentication"])
 async def get_me(request: FastAPIRequest): # Changed 'Request' to 'FastAPIRequest'
     logger.debug("Checking user authentication status (/api/me).")
-    creds_dict = user_sessions.get('credentials')
+    _, session = await request_session(request)
+    creds_dict = session.get('credentials')
     if not creds_dict:
         logger.info("User is not authenticated (no credentials in session).")
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -169,94 +391,441 @@ async def get_me(request: FastAPIRequest): # Changed 'Request' to 'FastAPIReques
     return UserProfileResponse(message="User is authenticated (simulated).", data=CredentialsModel(**creds_dict))
 
 # --- Helper to get Google Drive Service ---
-def get_drive_service(request: FastAPIRequest): # Changed 'Request' to 'FastAPIRequest'
-    logger.debug("Attempting to get Google Drive service instance.")
-    creds_dict = user_sessions.get('credentials')
-    if not creds_dict:
-        logger.warning("Credentials not found in session. User needs to authenticate.")
-        raise HTTPException(status_code=401, detail="User not authenticated. Please login first via /api/auth/login/google")
+@lru_cache(maxsize=1)
+def drive_discovery_document() -> dict:
+    """Drive v3 discovery document, read from the copy bundled with googleapiclient and parsed once per process."""
+    return json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+
+# --- Simulated Drive service (placeholder client ID) ---
+# Decided once at startup; endpoints only branch on it where the mock cannot stand in for a real request (media download)
+USE_MOCK_DRIVE = config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE"
+if USE_MOCK_DRIVE:
+    logger.warning("Using placeholder Google Client ID. Drive API calls will be SIMULATED by MockDriveService.")
+else:
+    drive_discovery_document() # Parse it at startup (per worker), not on the first request's critical path
+
+MOCK_SEED_FILES = ({'id': 'sim_id_1', 'name': 'Simulated File.txt', 'mimeType': 'text/plain', 'size': '1024', 'modifiedTime': '2023-01-01T12:00:00Z', 'iconLink': 'sim_icon_link', 'webViewLink': 'sim_webview_link', 'parents': ['root']},)
+MOCK_CONTENT = b"simulated file content"
+MOCK_PARENT_QUERY_RE = re.compile(r"'([^']+)' in parents")
+
+def mock_http_error(status: int, message: str) -> HttpError:
+    """The HttpError Drive would raise, so endpoints take their real error paths in simulated mode too."""
+    return HttpError(httplib2.Response({'status': status}), json.dumps({"error": {"code": status, "message": message}}).encode())
+
+class MockRequest:
+    """A simulated Drive request; like a real HttpRequest, it does nothing until executed."""
+    def __init__(self, run): self.run = run
+    def execute(self): return self.run()
+
+class MockBatchRequest:
+    """Stands in for BatchHttpRequest: runs the queued requests one by one and reports each to the callback."""
+    def __init__(self, callback): self.callback = callback; self.requests = []
+    def add(self, request, request_id): self.requests.append((request_id, request))
+    def execute(self, http=None):
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+class MockDriveService:
+    """
+    In-memory stand-in for the Drive files API: creates, renames and deletes are kept, so the CRUD endpoints can be
+    exercised end to end without Google credentials. State is per process and starts from MOCK_SEED_FILES.
+    """
+    def __init__(self):
+        self._lock = threading.Lock() # Requests execute in worker threads
+        self._files = {item['id']: dict(item) for item in MOCK_SEED_FILES}
+        self._next_id = 1
+        logger.debug("MockDriveService initialized.")
+
+    def files(self): return self
+    def new_batch_http_request(self, callback): return MockBatchRequest(callback)
+
+    def _existing(self, file_id: str) -> dict:
+        item = self._files.get(file_id)
+        if item is None:
+            raise mock_http_error(404, f"File not found: {file_id}.")
+        return item
+
+    def list(self, q="", pageSize=100, **kwargs):
+        logger.info("MockDriveService: files().list() called", extra={"props": {"q": q, "pageSize": pageSize, **kwargs}})
+        match = MOCK_PARENT_QUERY_RE.search(q)
+        def run():
+            with self._lock:
+                items = [dict(item) for item in self._files.values() if not match or match.group(1) in item.get('parents', ())]
+            return {'files': items[:pageSize], 'nextPageToken': None}
+        return MockRequest(run)
+
+    def list_next(self, previous_request, previous_response): return None # Everything fits on one simulated page
 
+    def create(self, body=None, media_body=None, fields=None):
+        body = body or {}
+        logger.info("MockDriveService: files().create() called", extra={"props": {"body": body, "fields": fields}})
+        def run():
+            with self._lock:
+                file_id = f"sim_created_id_{self._next_id}"
+                self._next_id += 1
+                item = {'id': file_id, 'name': body.get('name', 'sim_created_item'), 'mimeType': body.get('mimeType') or (media_body.mimetype() if media_body else 'text/plain'), 'parents': body.get('parents', ['root'])}
+                self._files[file_id] = item
+                return dict(item)
+        return MockRequest(run)
+
+    def get(self, fileId, fields="*"):
+        logger.info(f"MockDriveService: files().get(fileId='{fileId}') called", extra={"props":{"fileId":fileId, "fields":fields}})
+        def run():
+            with self._lock:
+                return dict(self._existing(fileId))
+        return MockRequest(run)
+
+    def get_media(self, fileId):
+        logger.info(f"MockDriveService: files().get_media(fileId='{fileId}') called", extra={"props":{"fileId":fileId}})
+        return MockRequest(lambda: io.BytesIO(MOCK_CONTENT))
+
+    def delete(self, fileId):
+        logger.info(f"MockDriveService: files().delete(fileId='{fileId}') called", extra={"props":{"fileId":fileId}})
+        def run():
+            with self._lock:
+                self._existing(fileId)
+                doomed = [fileId] # Like Drive, deleting a folder deletes everything under it
+                while doomed:
+                    file_id = doomed.pop()
+                    self._files.pop(file_id, None)
+                    doomed.extend(child_id for child_id, item in self._files.items() if file_id in item.get('parents', ()))
+        return MockRequest(run)
+
+    def update(self, fileId, body, fields=None):
+        logger.info(f"MockDriveService: files().update(fileId='{fileId}') called", extra={"props":{"fileId":fileId, "body":body, "fields":fields}})
+        def run():
+            with self._lock:
+                item = self._existing(fileId)
+                item.update(body)
+                return dict(item)
+        return MockRequest(run)
+
+MOCK_DRIVE_SERVICE = MockDriveService() # One instance, so every request sees the same simulated Drive
+
+# --- Access token refresh ---
+# Tokens are refreshed by one background task per session, a few minutes before they expire, so no user request waits
+# on the refresh round-trip. A request that still finds its token expired (e.g. first use after a restart) awaits that
+# session's single in-flight refresh rather than starting its own. Each worker refreshes the sessions it serves; a
+# duplicate refresh from another worker is harmless, as refresh tokens stay valid.
+TOKEN_REFRESH_MARGIN_SECONDS = 5 * 60
+TOKEN_REFRESH_MIN_INTERVAL_SECONDS = 60 # Guards against a refresh loop if a token comes back already near expiry
+# Background refresh stops after this long without requests; the session itself lives on, and its next request
+# refreshes on demand (and restarts the background task)
+TOKEN_REFRESH_IDLE_SECONDS = 60 * 60
+SIMULATED_TOKEN_LIFETIME = timedelta(hours=1) # What Google grants; used while the token exchange is simulated
+
+def utcnow() -> datetime:
+    """Naive UTC, as google-auth uses for Credentials.expiry."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def seconds_until_refresh(creds_dict: dict) -> float:
+    """Time left before a token should be refreshed; credentials saved without an expiry are refreshed right away."""
+    expiry = creds_dict.get('expiry') # As written by credentials_to_dict: naive UTC ISO-8601 plus "Z"
+    if not expiry:
+        return 0
+    return (datetime.fromisoformat(expiry.rstrip("Z")) - utcnow()).total_seconds() - TOKEN_REFRESH_MARGIN_SECONDS
+
+def refresh_credentials(creds_dict: dict) -> dict:
+    """Refresh an access token (blocking). Returns the new credentials dict."""
     credentials = Credentials.from_authorized_user_info(creds_dict)
-    if credentials.expired and credentials.refresh_token:
-        logger.info("Token is expired, attempting (simulated) refresh.", extra={"props": {"client_id": credentials.client_id}})
+    old_service_key = drive_service_key(credentials)
+    # credentials.refresh(GOOGLE_AUTH_REQUEST) # Real refresh
+    credentials.token = 'refreshed_dummy_access_token' # Simulate refresh
+    credentials.expiry = utcnow() + SIMULATED_TOKEN_LIFETIME
+    with _drive_services_lock:
+        _drive_services.pop(old_service_key) # The old token's service is dead
+    return credentials_to_dict(credentials)
+
+async def _refresh_session_credentials(session_id: str) -> dict | None:
+    session = await session_store.get(session_id, touch=False)
+    creds_dict = session.get('credentials') if session else None
+    if not creds_dict or not creds_dict.get('refresh_token'):
+        return None
+    logger.info("Refreshing access token (simulated).", extra={"props": {"client_id": creds_dict.get('client_id')}})
+    try:
+        creds_dict = await run_drive_call(refresh_credentials, creds_dict)
+    except Exception as e:
+        logger.error(f"Error refreshing token (simulated): {str(e)}", exc_info=True)
+        session.pop('credentials', None) # No longer usable; the user has to log in again
+        await session_store.set(session_id, session)
+        return None
+    session['credentials'] = creds_dict
+    await session_store.set(session_id, session)
+    logger.info("Token refresh (simulated) successful.")
+    return creds_dict
+
+_inflight_refreshes: dict[str, asyncio.Task] = {}
+
+async def refreshed_credentials(session_id: str) -> dict | None:
+    """Refresh a session's token now, sharing one refresh between concurrent callers. None if it could not be refreshed."""
+    task = _inflight_refreshes.get(session_id)
+    if task is None:
+        task = _inflight_refreshes[session_id] = asyncio.create_task(_refresh_session_credentials(session_id))
+        task.add_done_callback(lambda _: _inflight_refreshes.pop(session_id, None))
+    return await asyncio.shield(task) # A cancelled request must not cancel the refresh other requests are waiting on
+
+class TokenRefresher:
+    """Background task keeping one session's access token fresh while the session is in use."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.last_used = time.monotonic()
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
         try:
-            # credentials.refresh(GoogleAuthRequest()) # Real refresh
-            if credentials.token == 'dummy_access_token': # Simulate refresh
-                credentials.token = 'refreshed_dummy_access_token'
-                user_sessions['credentials'] = credentials_to_dict(credentials)
-            logger.info("Token refresh (simulated) successful.")
+            while True:
+                session = await session_store.get(self.session_id, touch=False) # Refreshing is not use of the session
+                creds_dict = session.get('credentials') if session else None
+                if not creds_dict or time.monotonic() - self.last_used > TOKEN_REFRESH_IDLE_SECONDS:
+                    return # Logged out, expired or idle
+                delay = seconds_until_refresh(creds_dict)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue # Re-read: the session may have changed while sleeping
+                if await refreshed_credentials(self.session_id) is None:
+                    return
+                await asyncio.sleep(TOKEN_REFRESH_MIN_INTERVAL_SECONDS)
         except Exception as e:
-            logger.error(f"Error refreshing token (simulated): {str(e)}", exc_info=True)
-            user_sessions.pop('credentials', None)
-            raise HTTPException(status_code=401, detail=f"Failed to refresh token, please re-authenticate: {str(e)}")
-
-    if config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE":
-        logger.warning("Using placeholder Google Client ID. Drive API calls will be SIMULATED by MockDriveService.")
-        # MockDriveService definition (simplified for brevity, assume it's complete from previous steps)
-        class MockDriveService:
-            def __init__(self): logger.debug("MockDriveService initialized.")
-            def files(self): return self
-            def list(self, **kwargs): logger.info("MockDriveService: files().list() called", extra={"props": kwargs}); return self
-            def execute(self): logger.info("MockDriveService: ...execute() called"); return {'files': [{'id': 'sim_id_1', 'name': 'Simulated File.txt', 'mimeType': 'text/plain', 'size': '1024', 'modifiedTime': '2023-01-01T12:00:00Z', 'iconLink': 'sim_icon_link', 'webViewLink': 'sim_webview_link'}], 'nextPageToken': None}
-            def create(self, **kwargs): body = kwargs.get("body", {}); logger.info("MockDriveService: files().create() called", extra={"props": {"body": body, "fields": kwargs.get("fields")}}); return {"id": "sim_created_id", "name": body.get("name", "sim_created_item"), 'mimeType': body.get('mimeType', 'text/plain')}
-            def get(self, fileId, fields="*"): logger.info(f"MockDriveService: files().get(fileId='{fileId}') called", extra={"props":{"fileId":fileId, "fields":fields}}); class MG: execute=lambda: ({'id': fileId, 'name': 'Simulated Get File.txt', 'mimeType': 'text/plain'}); return MG()
-            def get_media(self, fileId): logger.info(f"MockDriveService: files().get_media(fileId='{fileId}') called", extra={"props":{"fileId":fileId}}); class MGM: execute=lambda: (io.BytesIO(b"simulated file content")); return MGM()
-            def delete(self, fileId): logger.info(f"MockDriveService: files().delete(fileId='{fileId}') called", extra={"props":{"fileId":fileId}}); class MD: execute=lambda: (None); return MD()
-            def update(self, fileId, body): logger.info(f"MockDriveService: files().update(fileId='{fileId}') called", extra={"props":{"fileId":fileId, "body":body}}); class MU: execute=lambda: ({'id': fileId, 'name': body.get('name', 'updated_name.txt')}); return MU()
-        return MockDriveService()
-
-    logger.info("Building real Google Drive service instance.")
+            logger.error(f"Background token refresh stopped: {str(e)}", exc_info=True)
+        finally:
+            if _token_refreshers.get(self.session_id) is self:
+                del _token_refreshers[self.session_id]
+
+_token_refreshers: dict[str, TokenRefresher] = {}
+
+def keep_token_fresh(session_id: str):
+    """Start (or keep alive) background refresh for a session that is being used."""
+    refresher = _token_refreshers.get(session_id)
+    if refresher is None:
+        _token_refreshers[session_id] = TokenRefresher(session_id)
+    else:
+        refresher.last_used = time.monotonic()
+
+async def drive_service_for(request: FastAPIRequest):
+    """Drive service for the caller's session credentials."""
+    session_id, session = await request_session(request)
+    creds_dict = session.get('credentials')
+    if not creds_dict:
+        logger.warning("Credentials not found in session. User needs to authenticate.")
+        raise HTTPException(status_code=401, detail="User not authenticated. Please login first via /api/auth/login/google")
+    keep_token_fresh(session_id)
+    if seconds_until_refresh(creds_dict) + TOKEN_REFRESH_MARGIN_SECONDS <= 0: # Expired; normally refreshed before this
+        creds_dict = await refreshed_credentials(session_id)
+        if creds_dict is None:
+            raise HTTPException(status_code=401, detail="Failed to refresh token, please re-authenticate.")
+    return await run_drive_call(get_drive_service, creds_dict) # Building the service is blocking
+
+# Building a service from the (cached) discovery document still takes milliseconds, so services are reused per access
+# token: a user's back-to-back requests share one, and a refreshed token gets a new entry (the old one is dropped).
+# Entries expire after a few minutes, so services for tokens that are no longer used do not pile up until evicted.
+# Sharing is safe across worker threads because requests execute over thread-local connections (execute_drive_request)
+# and each download gets its own (drive_media_request); the service's own Http is never used.
+DRIVE_SERVICE_TTL_SECONDS = 5 * 60
+_drive_services = LocalTTLCache(DRIVE_SERVICE_TTL_SECONDS, 1024)
+_drive_services_lock = threading.Lock() # Services are looked up from worker threads
+
+def drive_service_key(credentials: Credentials) -> str:
+    """Cache key for a set of credentials; hashed so tokens and the client secret are not kept as dict keys."""
+    parts = (credentials.token, credentials.refresh_token, credentials.token_uri, credentials.client_id, credentials.client_secret, tuple(credentials.scopes or ()))
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+def cached_drive_service(credentials: Credentials):
+    key = drive_service_key(credentials)
+    with _drive_services_lock:
+        service = _drive_services.get(key)
+    if service is None:
+        logger.info("Building real Google Drive service instance.")
+        service = build_from_document(drive_discovery_document(), credentials=credentials)
+        with _drive_services_lock:
+            _drive_services.set(key, service)
+    return service
+
+def get_drive_service(creds_dict: dict):
+    """Build (or reuse) a Drive service for stored credentials (blocking). Tokens are refreshed elsewhere; see TokenRefresher."""
+    logger.debug("Attempting to get Google Drive service instance.")
+    if USE_MOCK_DRIVE:
+        return MOCK_DRIVE_SERVICE
+
     try:
-        service = build('drive', 'v3', credentials=credentials)
-        logger.info("Successfully built real Google Drive service instance.")
-        return service
+        return cached_drive_service(Credentials.from_authorized_user_info(creds_dict))
     except HttpError as error:
-        logger.error(f"HttpError building Drive service: {error.resp.status} - {error._get_reason()}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to build Google Drive service: {error.resp.status} - {error._get_reason()}")
+        reason = error._get_reason()
+        logger.error(f"HttpError building Drive service: {error.resp.status} - {reason}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to build Google Drive service: {error.resp.status} - {reason}")
     except Exception as e:
         logger.error(f"General error building Drive service: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"General error building Google Drive service: {str(e)}")
 
+# --- Drive request constants ---
+DRIVE_FILE_FIELDS = "id, name, mimeType, size, modifiedTime, iconLink, webViewLink, webContentLink" # Everything DriveFile holds
+DRIVE_LIST_FIELDS = f"nextPageToken, files({DRIVE_FILE_FIELDS})"
+# Per-child details a folder view needs, returned by the same files.list call rather than one files.get per child
+DRIVE_LIST_DETAILED_FIELDS = f"nextPageToken, files({DRIVE_FILE_FIELDS}, thumbnailLink, capabilities(canEdit, canRename, canDelete))"
+# Drive IDs (and the 'root' alias) are URL-safe base64; anything else, a quote in particular, could rewrite the list query
+DRIVE_ID_PATTERN = r"^[A-Za-z0-9_-]{1,128}$"
+DRIVE_ID_RE = re.compile(DRIVE_ID_PATTERN)
+
+@lru_cache(maxsize=4096)
+def folder_children_query(folder_id: str) -> str:
+    """files.list query for a folder's (untrashed) children. Cached: users reopen the same folders over and over."""
+    if not DRIVE_ID_RE.match(folder_id): # Endpoints validate already; this guards any other caller
+        raise ValueError(f"Invalid Drive ID: {folder_id!r}")
+    return f"'{folder_id}' in parents and trashed=false"
+
+# Request builders shared by the single-item endpoints and /api/drive/batch, so both return the same metadata shape
+def delete_file_request(service, file_id: str):
+    return service.files().delete(fileId=file_id)
+
+def rename_file_request(service, file_id: str, new_name: str):
+    return service.files().update(fileId=file_id, body={'name': new_name}, fields=DRIVE_FILE_FIELDS)
+
+# --- Drive API errors ---
+EXPECTED_HTTP_ERROR_STATUSES = frozenset({401, 403, 404}) # Client-side outcomes (stale links, revoked access), not server faults
+
+def _raise_from_http_error(error: HttpError, context: str, props: dict | None = None, details: dict[int, str] | None = None) -> NoReturn:
+    """Log a Drive HttpError once and re-raise it as an HTTPException with the same status.
+
+    Expected statuses are logged as warnings without a traceback; only 5xx errors capture one.
+    `details` overrides the response detail for specific statuses (default: Drive's error reason).
+    """
+    status = error.resp.status
+    reason = error._get_reason() # Parses the error body; call it once
+    level = logging.WARNING if status in EXPECTED_HTTP_ERROR_STATUSES else logging.ERROR
+    logger.log(level, "%s failed: %d %s", context, status, reason, exc_info=error if status >= 500 else None, extra={"props": {**(props or {}), "status_code": status}})
+    raise HTTPException(status_code=status, detail=(details or {}).get(status, reason))
+
+# --- Streaming downloads ---
+def drive_media_request(service, file_id: str) -> HttpRequest:
+    """get_media request with a connection of its own: MediaIoBaseDownload keeps using request.http for every chunk,
+    from whichever worker thread runs it, so it must not be the (shared) service's or a thread-local one."""
+    request = service.files().get_media(fileId=file_id)
+    request.http = AuthorizedHttp(request.http.credentials, http=httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+    return request
+
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # One Drive range request per chunk; also the most a download holds in memory
+
+def next_media_chunk(downloader: MediaIoBaseDownload, buffer: io.BytesIO, file_id: str) -> tuple[bytes, bool]:
+    """Fetch the next chunk (blocking) and take it out of the buffer. Returns (data, done)."""
+    status, done = downloader.next_chunk()
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    if status and status.total_size and logger.isEnabledFor(logging.DEBUG): # Per chunk: build nothing unless DEBUG is on
+        # Log only when this chunk crosses a 10% step (computed from the chunk size, so no state is kept between chunks)
+        step = status.resumable_progress * 10 // status.total_size
+        if step > (status.resumable_progress - len(data)) * 10 // status.total_size:
+            logger.debug("Download progress for %s: %d%%", file_id, step * 10, extra={"props": {"file_id": file_id, "progress": status.progress()}})
+    return data, done
+
+async def stream_media_chunks(downloader: MediaIoBaseDownload, buffer: io.BytesIO, first_chunk: bytes, done: bool, file_id: str, file_name: str):
+    """Yield a Drive download chunk by chunk as it arrives, instead of buffering the whole file first."""
+    size_bytes = len(first_chunk)
+    yield first_chunk
+    while not done: # Pulled one chunk at a time, so a slow client naturally throttles the download
+        chunk, done = await run_drive_call(next_media_chunk, downloader, buffer, file_id)
+        size_bytes += len(chunk)
+        yield chunk
+    logger.info("Successfully downloaded file_id: %s, name: %s", file_id, file_name, extra={"props": {"file_id": file_id, "file_name": file_name, "size_bytes": size_bytes}})
+
 # --- Google Drive API Endpoints (with logging) ---
-@app.get("/api/drive/files", response_model=FileListResponse, summary="List Files and Folders", tags=["Drive Operations"])
+# response_model=None: Drive already returns exactly the requested fields, so the page is built with model_construct
+# (no validation) and serialized once, instead of validating each item here and again in FastAPI's response handling
+@app.get("/api/drive/files", response_model=None, responses={200: {"model": FileListResponse}}, summary="List Files and Folders", tags=["Drive Operations"])
 async def list_files(
     request: FastAPIRequest,
-    folder_id: str = Query('root', description="ID of the folder to list.", example="root"),
-    page_size: int = Query(10, description="Items per page.", example=20, ge=1, le=100)
+    folder_id: str = Query('root', description="ID of the folder to list.", example="root", pattern=DRIVE_ID_PATTERN),
+    page_size: int = Query(10, description="Items per page.", example=20, ge=1, le=100),
+    details: bool = Query(True, description="Include thumbnailLink and capabilities for each item.")
 ):
-    logger.info(f"Listing files for folder_id: {folder_id}", extra={"props": {"folder_id": folder_id, "page_size": page_size}})
-    service = get_drive_service(request)
+    logger.info("Listing files for folder_id: %s", folder_id, extra={"props": {"folder_id": folder_id, "page_size": page_size}})
+    service = await drive_service_for(request) # Also checks the caller is still authenticated before anything is served from cache
+    cache_key = await listing_cache_key(request, folder_id, page_size, details)
+    cached_page = await listing_cache.get(cache_key) if cache_key else None
+    if cached_page is not None:
+        logger.debug("Serving cached listing for folder_id: %s", folder_id)
+        return Response(content=cached_page, media_type="application/json")
     try:
-        q = f"'{folder_id}' in parents and trashed=false"
-        results = service.files().list(q=q, pageSize=page_size, fields="nextPageToken, files(id, name, mimeType, size, modifiedTime, iconLink, webViewLink, webContentLink)").execute()
+        results = await run_drive_request(service.files().list(q=folder_children_query(folder_id), pageSize=page_size, fields=DRIVE_LIST_DETAILED_FIELDS if details else DRIVE_LIST_FIELDS))
         items = results.get('files', [])
-        logger.info(f"Found {len(items)} files/folders in folder_id: {folder_id}", extra={"props": {"item_count": len(items), "folder_id": folder_id, "has_next_page": bool(results.get('nextPageToken'))}})
-        return FileListResponse(items=[DriveFile(**item) for item in items], nextPageToken=results.get('nextPageToken'))
+        logger.info("Found %d files/folders in folder_id: %s", len(items), folder_id, extra={"props": {"item_count": len(items), "folder_id": folder_id, "has_next_page": bool(results.get('nextPageToken'))}})
+        page = FileListResponse.model_construct(items=[DriveFile.model_construct(**item) for item in items], nextPageToken=results.get('nextPageToken'))
+        body = page.model_dump_json()
+        if cache_key:
+            await listing_cache.set(cache_key, body)
+        return Response(content=body, media_type="application/json")
     except HttpError as error:
-        logger.error(f"HttpError listing files for folder '{folder_id}': {error.resp.status} - {error._get_reason()}", exc_info=True, extra={"props": {"folder_id": folder_id, "status_code": error.resp.status}})
-        raise HTTPException(status_code=error.resp.status, detail=str(error))
+        _raise_from_http_error(error, f"Listing files for folder '{folder_id}'", {"folder_id": folder_id})
     except Exception as e:
         logger.error(f"Unexpected error listing files for folder '{folder_id}': {str(e)}", exc_info=True, extra={"props": {"folder_id": folder_id}})
         raise HTTPException(status_code=500, detail=str(e))
 
+def listing_ndjson(items: list) -> bytes:
+    """One JSON line per item, shaped like DriveFile."""
+    return b"".join(DriveFile.model_construct(**item).model_dump_json().encode() + b"\n" for item in items)
+
+@app.get("/api/drive/files/stream", response_class=StreamingResponse, summary="Stream All Files in a Folder (NDJSON)", tags=["Drive Operations"])
+async def stream_files(
+    request: FastAPIRequest,
+    folder_id: str = Query('root', description="ID of the folder to list.", example="root", pattern=DRIVE_ID_PATTERN),
+    page_size: int = Query(100, description="Items fetched from Drive per page.", ge=1, le=100),
+    details: bool = Query(True, description="Include thumbnailLink and capabilities for each item.")
+):
+    """
+    Every item in a folder as newline-delimited DriveFile JSON, fetched page by page. Clients can render the first
+    page while later ones are still being fetched; memory per request stays at one page.
+    """
+    logger.info("Streaming files for folder_id: %s", folder_id, extra={"props": {"folder_id": folder_id, "page_size": page_size}})
+    service = await drive_service_for(request)
+    files = service.files()
+    list_request = files.list(q=folder_children_query(folder_id), pageSize=page_size, fields=DRIVE_LIST_DETAILED_FIELDS if details else DRIVE_LIST_FIELDS)
+    try:
+        # The first page is fetched before responding, so Drive errors (404/403) still become proper HTTP errors
+        results = await run_drive_request(list_request)
+    except HttpError as error:
+        _raise_from_http_error(error, f"Listing files for folder '{folder_id}'", {"folder_id": folder_id})
+    except Exception as e:
+        logger.error(f"Unexpected error listing files for folder '{folder_id}': {str(e)}", exc_info=True, extra={"props": {"folder_id": folder_id}})
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def pages():
+        nonlocal list_request, results
+        item_count = 0
+        while True:
+            items = results.get('files', [])
+            item_count += len(items)
+            if items:
+                yield listing_ndjson(items)
+            list_request = files.list_next(list_request, results)
+            if list_request is None:
+                break
+            try:
+                results = await run_drive_request(list_request)
+            except Exception as e: # The status line is already sent; end the stream short and leave it to the log
+                logger.error(f"Error fetching a later page for folder '{folder_id}': {str(e)}", exc_info=e, extra={"props": {"folder_id": folder_id, "item_count": item_count}})
+                return
+        logger.info("Streamed %d files/folders in folder_id: %s", item_count, folder_id, extra={"props": {"item_count": item_count, "folder_id": folder_id}})
+
+    return StreamingResponse(pages(), media_type="application/x-ndjson")
+
 @app.post("/api/drive/folders", response_model=CreatedFolderResponse, summary="Create New Folder", tags=["Drive Operations"])
 async def create_folder(
     request: FastAPIRequest,
     folder_name: str = Form(..., description="Name for the new folder.", example="My Project")
 ):
-    logger.info(f"Attempting to create folder: {folder_name}", extra={"props": {"target_folder_name": folder_name}})
-    service = get_drive_service(request)
+    logger.info("Attempting to create folder: %s", folder_name, extra={"props": {"target_folder_name": folder_name}})
+    service = await drive_service_for(request)
     try:
         file_metadata = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder'}
-        if config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE":
-            folder = service.files().create(body=file_metadata, fields='id, name')
-        else:
-            folder = service.files().create(body=file_metadata, fields='id, name').execute()
-        logger.info(f"Folder '{folder.get('name')}' created successfully with ID '{folder.get('id')}'", extra={"props": {"created_folder_id": folder.get('id'), "created_folder_name": folder.get('name')}})
+        folder = await run_drive_request(service.files().create(body=file_metadata, fields='id, name'))
+        logger.info("Folder '%s' created successfully with ID '%s'", folder.get('name'), folder.get('id'), extra={"props": {"created_folder_id": folder.get('id'), "created_folder_name": folder.get('name')}})
+        await invalidate_listings(request)
         return CreatedFolderResponse(**folder)
     except HttpError as error:
-        logger.error(f"HttpError creating folder '{folder_name}': {error.resp.status} - {error._get_reason()}", exc_info=True, extra={"props": {"folder_name": folder_name, "status_code": error.resp.status}})
-        raise HTTPException(status_code=error.resp.status, detail=str(error))
+        _raise_from_http_error(error, f"Creating folder '{folder_name}'", {"folder_name": folder_name})
     except Exception as e:
         logger.error(f"Unexpected error creating folder '{folder_name}': {str(e)}", exc_info=True, extra={"props": {"folder_name": folder_name}})
         raise HTTPException(status_code=500, detail=f"Error creating folder: {str(e)}")
@@ -268,76 +837,139 @@ async def upload_file(
     file: UploadFile = File(..., description="The file to upload."),
     folder_id: str = Form(None, description="Optional ID of the folder to upload into.", example="folder_id_example")
 ):
-    logger.info(f"Attempting to upload file: {file.filename}", extra={"props": {"filename": file.filename, "content_type": file.content_type, "target_folder_id": folder_id}})
-    service = get_drive_service(request)
-    media_body_for_create = None
+    logger.info("Attempting to upload file: %s", file.filename, extra={"props": {"filename": file.filename, "content_type": file.content_type, "target_folder_id": folder_id}})
+    service = await drive_service_for(request)
     try:
         file_metadata = {'name': file.filename}
         if folder_id: file_metadata['parents'] = [folder_id]
-        contents = await file.read()
-        media_body_for_create = io.BytesIO(contents)
-
-        if config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE":
-            created_file = service.files().create(body=file_metadata, media_body=media_body_for_create, fields='id, name, webViewLink')
-        else:
-            media_upload = MediaIoBaseUpload(media_body_for_create, mimetype=file.content_type, resumable=True)
-            created_file = service.files().create(body=file_metadata, media_body=media_upload, fields='id, name, webViewLink').execute()
+        # Upload straight from Starlette's SpooledTemporaryFile: no full in-memory copy of the body
+        file.file.seek(0)
+        # Files that fit in one chunk go up as a single multipart request; a resumable session would cost an extra round-trip
+        resumable = file.size is None or file.size > UPLOAD_CHUNK_SIZE
+        media_upload = MediaIoBaseUpload(file.file, mimetype=file.content_type or "application/octet-stream", chunksize=UPLOAD_CHUNK_SIZE, resumable=resumable)
+        # Resumable upload is blocking HTTP (and file reads); keep it off the event loop
+        created_file = await run_drive_request(service.files().create(body=file_metadata, media_body=media_upload, fields='id, name, webViewLink'))
 
-        logger.info(f"File '{created_file.get('name')}' uploaded successfully with ID '{created_file.get('id')}'", extra={"props": {"uploaded_file_id": created_file.get('id'), "uploaded_file_name": created_file.get('name'), "size": len(contents)}})
+        logger.info("File '%s' uploaded successfully with ID '%s'", created_file.get('name'), created_file.get('id'), extra={"props": {"uploaded_file_id": created_file.get('id'), "uploaded_file_name": created_file.get('name'), "size": file.size}})
+        await invalidate_listings(request)
         return UploadedFileResponse(id=created_file.get('id'), name=created_file.get('name'), link=created_file.get('webViewLink'))
     except HttpError as error:
-        logger.error(f"HttpError uploading file '{file.filename}': {error.resp.status} - {error._get_reason()}", exc_info=True, extra={"props": {"filename": file.filename, "status_code": error.resp.status}})
-        raise HTTPException(status_code=error.resp.status, detail=str(error))
+        _raise_from_http_error(error, f"Uploading file '{file.filename}'", {"filename": file.filename})
     except Exception as e:
         logger.error(f"Unexpected error uploading file '{file.filename}': {str(e)}", exc_info=True, extra={"props": {"filename": file.filename}})
         raise HTTPException(status_code=500, detail=f"An error occurred during upload: {str(e)}")
     finally:
-        if media_body_for_create: media_body_for_create.close()
         if file: await file.close()
 
 
+@app.put("/api/drive/files/upload/stream", response_model=UploadedFileResponse, summary="Upload File (Raw Body)", tags=["Drive Operations"])
+async def upload_file_stream(
+    request: FastAPIRequest,
+    name: str = Query(..., min_length=1, description="Name of the new file.", example="report.pdf"),
+    folder_id: str | None = Query(None, pattern=DRIVE_ID_PATTERN, description="Optional ID of the folder to upload into.", example="folder_id_example")
+):
+    """
+    Upload the raw request body as a file; its Content-Type becomes the file's MIME type. Unlike the multipart
+    endpoint, the body is never spooled: it is piped chunk by chunk into a Drive resumable upload.
+    """
+    mimetype = request.headers.get("content-type") or "application/octet-stream"
+    logger.info("Attempting to stream upload file: %s", name, extra={"props": {"filename": name, "content_type": mimetype, "target_folder_id": folder_id}})
+    service = await drive_service_for(request)
+    file_metadata = {'name': name}
+    if folder_id: file_metadata['parents'] = [folder_id]
+    send_stream, receive_stream = anyio.create_memory_object_stream(UPLOAD_STREAM_BUFFER)
+    media_upload = StreamedMediaUpload(receive_stream, mimetype)
+    outcome = {}
+
+    async def upload():
+        try:
+            outcome["file"] = await run_drive_request(service.files().create(body=file_metadata, media_body=media_upload, fields='id, name, webViewLink'))
+        except Exception as e:
+            outcome["file"] = e
+        finally:
+            receive_stream.close() # Unblocks the body pump if the upload ended early
+
+    async def pump_body():
+        async with send_stream:
+            try:
+                async for piece in request.stream():
+                    if piece:
+                        await send_stream.send(piece)
+            except anyio.BrokenResourceError:
+                pass
+            except Exception as e: # e.g. ClientDisconnect: fail the upload rather than finalize a partial file
+                try:
+                    await send_stream.send(e)
+                except anyio.BrokenResourceError:
+                    pass
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(upload)
+        await pump_body()
+
+    created_file = outcome["file"]
+    try:
+        if isinstance(created_file, Exception):
+            raise created_file
+        logger.info("File '%s' uploaded successfully with ID '%s'", created_file.get('name'), created_file.get('id'), extra={"props": {"uploaded_file_id": created_file.get('id'), "uploaded_file_name": created_file.get('name'), "size": media_upload.bytes_received}})
+        await invalidate_listings(request)
+        return UploadedFileResponse(id=created_file.get('id'), name=created_file.get('name'), link=created_file.get('webViewLink'))
+    except HttpError as error:
+        _raise_from_http_error(error, f"Uploading file '{name}'", {"filename": name})
+    except Exception as e:
+        logger.error(f"Unexpected error uploading file '{name}': {str(e)}", exc_info=e, extra={"props": {"filename": name}})
+        raise HTTPException(status_code=500, detail=f"An error occurred during upload: {str(e)}")
+
+
 @app.get("/api/drive/files/{file_id}/download", summary="Download File", tags=["Drive Operations"], responses={200: {}, 202: {"model": DownloadSimulatedResponse}})
 async def download_file(
     request: FastAPIRequest,
     file_id: str = Path(..., description="ID of the file to download.", example="file_id_example")
 ):
-    logger.info(f"Attempting to download file_id: {file_id}", extra={"props": {"file_id": file_id}})
-    service = get_drive_service(request)
+    logger.info("Attempting to download file_id: %s", file_id, extra={"props": {"file_id": file_id}})
+    service = await drive_service_for(request)
     try:
-        if config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE":
-            file_metadata = service.files().get(fileId=file_id, fields="name, mimeType, webViewLink").execute()
-        else:
-            file_metadata = service.files().get(fileId=file_id, fields="name, mimeType, webViewLink, webContentLink").execute()
+        # Metadata and the first media chunk are independent round-trips, so both are requested at once. Each outcome
+        # (result or exception) is captured, so one failing does not cancel the other or surface as an ExceptionGroup.
+        fh_download = io.BytesIO() # Holds one chunk at a time
+        downloader = None if USE_MOCK_DRIVE else MediaIoBaseDownload(fh_download, drive_media_request(service, file_id), chunksize=DOWNLOAD_CHUNK_SIZE)
+        outcomes = {}
+        async def capture(key, func, *args):
+            try:
+                outcomes[key] = await run_drive_call(func, *args)
+            except Exception as e:
+                outcomes[key] = e
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(capture, "metadata", execute_drive_request, service.files().get(fileId=file_id, fields="name, mimeType, size, webViewLink, webContentLink"))
+            if downloader:
+                tg.start_soon(capture, "first_chunk", next_media_chunk, downloader, fh_download, file_id)
+        if isinstance(outcomes["metadata"], Exception): raise outcomes["metadata"]
+        file_metadata = outcomes["metadata"]
         file_name = file_metadata.get("name", "downloaded_file")
         mime_type = file_metadata.get('mimeType', '')
 
-        if mime_type.startswith('application/vnd.google-apps'):
-            logger.info(f"File '{file_name}' (ID: {file_id}) is a Google Workspace document. Returning info, direct download requires export.", extra={"props": {"file_id": file_id, "file_name": file_name, "mime_type": mime_type}})
-            return JSONResponse(status_code=202, content=DownloadSimulatedResponse(message=f"File '{file_name}' is a Google Workspace document. Export is required.", name=file_name, file_id=file_id, webViewLink=file_metadata.get('webViewLink')).model_dump(exclude_none=True))
+        if mime_type.startswith('application/vnd.google-apps'): # Drive rejects get_media for these, so the media outcome is discarded
+            logger.info("File '%s' (ID: %s) is a Google Workspace document. Returning info, direct download requires export.", file_name, file_id, extra={"props": {"file_id": file_id, "file_name": file_name, "mime_type": mime_type}})
+            # Serialized straight to JSON bytes by pydantic-core, like the response_model endpoints
+            body = DownloadSimulatedResponse(message=f"File '{file_name}' is a Google Workspace document. Export is required.", name=file_name, file_id=file_id, webViewLink=file_metadata.get('webViewLink')).model_dump_json(exclude_none=True)
+            return Response(content=body, status_code=202, media_type="application/json")
 
-        if config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE":
+        if USE_MOCK_DRIVE: # MediaIoBaseDownload needs a real HttpRequest
             simulated_content = service.files().get_media(fileId=file_id).execute()
             simulated_content.seek(0)
-            logger.info(f"Simulated download for file_id: {file_id}, name: {file_name}", extra={"props": {"file_id": file_id, "file_name": file_name}})
-            return StreamingResponse(simulated_content, media_type="application/octet-stream", headers={"Content-Disposition": f"attachment; filename=sim_{file_name}"})
-
-        api_request_obj = service.files().get_media(fileId=file_id)
-        fh_download = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh_download, api_request_obj)
-        done = False
-        logger.info(f"Starting direct download for file_id: {file_id}, name: {file_name}", extra={"props": {"file_id": file_id, "file_name": file_name}})
-        while not done:
-            status, done = downloader.next_chunk()
-            if status: logger.debug(f"Download progress for {file_id}: {int(status.progress() * 100)}%", extra={"props": {"file_id": file_id, "progress": status.progress()}})
-        fh_download.seek(0)
-        logger.info(f"Successfully downloaded file_id: {file_id}, name: {file_name}", extra={"props": {"file_id": file_id, "file_name": file_name, "size_bytes": fh_download.getbuffer().nbytes}})
-        return StreamingResponse(fh_download, media_type=mime_type or "application/octet-stream", headers={"Content-Disposition": f"attachment; filename=\"{file_name}\""})
+            logger.info("Simulated download for file_id: %s, name: %s", file_id, file_name, extra={"props": {"file_id": file_id, "file_name": file_name}})
+            return StreamingResponse(simulated_content, media_type="application/octet-stream", headers={"Content-Disposition": f"attachment; filename=sim_{file_name}", "Content-Encoding": "identity"})
+
+        # The first chunk was fetched before responding, so Drive errors (404/403) still become proper HTTP errors
+        if isinstance(outcomes["first_chunk"], Exception): raise outcomes["first_chunk"]
+        first_chunk, done = outcomes["first_chunk"]
+        logger.info("Starting direct download for file_id: %s, name: %s", file_id, file_name, extra={"props": {"file_id": file_id, "file_name": file_name}})
+        headers = {"Content-Disposition": f"attachment; filename=\"{file_name}\"", "Content-Encoding": "identity"}
+        if file_metadata.get('size'): # Known length: clients can show progress, and the body is not chunk-encoded
+            headers["Content-Length"] = file_metadata['size']
+        return StreamingResponse(stream_media_chunks(downloader, fh_download, first_chunk, done, file_id, file_name), media_type=mime_type or "application/octet-stream", headers=headers)
     except HttpError as error:
-        logger.error(f"HttpError downloading file '{file_id}': {error.resp.status} - {error._get_reason()}", exc_info=True, extra={"props": {"file_id": file_id, "status_code": error.resp.status}})
-        detail_message = str(error) # Default
-        if error.resp.status == 404: detail_message = f"File not found: {file_id}"
-        if error.resp.status == 403 : detail_message = f"Access denied for file {file_id}. If it's a Google Workspace file, export is needed."
-        raise HTTPException(status_code=error.resp.status, detail=detail_message)
+        _raise_from_http_error(error, f"Downloading file '{file_id}'", {"file_id": file_id}, {404: f"File not found: {file_id}", 403: f"Access denied for file {file_id}. If it's a Google Workspace file, export is needed."})
     except Exception as e:
         logger.error(f"Unexpected error downloading file '{file_id}': {str(e)}", exc_info=True, extra={"props": {"file_id": file_id}})
         raise HTTPException(status_code=500, detail=f"An error occurred during download: {str(e)}")
@@ -347,16 +979,15 @@ async def delete_file_endpoint( # Renamed to avoid conflict with 'delete_file' i
     request: FastAPIRequest,
     file_id: str = Path(..., description="ID of the file or folder to delete.", example="file_id_example")
 ):
-    logger.info(f"Attempting to delete item_id: {file_id}", extra={"props": {"item_id": file_id}})
-    service = get_drive_service(request)
+    logger.info("Attempting to delete item_id: %s", file_id, extra={"props": {"item_id": file_id}})
+    service = await drive_service_for(request)
     try:
-        service.files().delete(fileId=file_id).execute()
-        logger.info(f"Successfully deleted item_id: {file_id}", extra={"props": {"item_id": file_id}})
+        await run_drive_request(delete_file_request(service, file_id))
+        logger.info("Successfully deleted item_id: %s", file_id, extra={"props": {"item_id": file_id}})
+        await invalidate_listings(request)
         return MessageResponse(message=f"File/Folder with ID: {file_id} deleted successfully.")
     except HttpError as error:
-        logger.error(f"HttpError deleting item '{file_id}': {error.resp.status} - {error._get_reason()}", exc_info=True, extra={"props": {"item_id": file_id, "status_code": error.resp.status}})
-        if error.resp.status == 404: raise HTTPException(status_code=404, detail=f"File/Folder not found: {file_id}")
-        raise HTTPException(status_code=error.resp.status, detail=str(error))
+        _raise_from_http_error(error, f"Deleting item '{file_id}'", {"item_id": file_id}, {404: f"File/Folder not found: {file_id}"})
     except Exception as e:
         logger.error(f"Unexpected error deleting item '{file_id}': {str(e)}", exc_info=True, extra={"props": {"item_id": file_id}})
         raise HTTPException(status_code=500, detail=f"Error deleting item: {str(e)}")
@@ -368,24 +999,71 @@ async def rename_file_endpoint( # Renamed
     file_id: str = Path(..., description="ID of the file/folder to rename.", example="file_id_example"),
     new_name: str = Form(..., description="The new name.", example="Updated Project Name")
 ):
-    logger.info(f"Attempting to rename item_id: {file_id} to '{new_name}'", extra={"props": {"item_id": file_id, "new_name": new_name}})
-    service = get_drive_service(request)
+    logger.info("Attempting to rename item_id: %s to '%s'", file_id, new_name, extra={"props": {"item_id": file_id, "new_name": new_name}})
+    service = await drive_service_for(request)
     try:
-        file_metadata_update = {'name': new_name}
-        if config.GOOGLE_CLIENT_ID == "YOUR_GOOGLE_CLIENT_ID_HERE":
-            updated_file_data = service.files().update(fileId=file_id, body=file_metadata_update, fields='id, name, mimeType, size, modifiedTime, iconLink, webViewLink, webContentLink').execute()
-        else:
-            updated_file_data = service.files().update(fileId=file_id, body=file_metadata_update, fields='id, name, mimeType, size, modifiedTime, iconLink, webViewLink, webContentLink').execute()
-        logger.info(f"Successfully renamed item_id: {file_id} to '{updated_file_data.get('name')}'", extra={"props": {"item_id": file_id, "updated_name": updated_file_data.get('name')}})
+        updated_file_data = await run_drive_request(rename_file_request(service, file_id, new_name))
+        logger.info("Successfully renamed item_id: %s to '%s'", file_id, updated_file_data.get('name'), extra={"props": {"item_id": file_id, "updated_name": updated_file_data.get('name')}})
+        await invalidate_listings(request)
         return DriveFile(**updated_file_data)
     except HttpError as error:
-        logger.error(f"HttpError renaming item '{file_id}': {error.resp.status} - {error._get_reason()}", exc_info=True, extra={"props": {"item_id": file_id, "new_name": new_name, "status_code": error.resp.status}})
-        if error.resp.status == 404: raise HTTPException(status_code=404, detail=f"File/Folder not found: {file_id}")
-        raise HTTPException(status_code=error.resp.status, detail=str(error))
+        _raise_from_http_error(error, f"Renaming item '{file_id}'", {"item_id": file_id, "new_name": new_name}, {404: f"File/Folder not found: {file_id}"})
     except Exception as e:
         logger.error(f"Unexpected error renaming item '{file_id}': {str(e)}", exc_info=True, extra={"props": {"item_id": file_id, "new_name": new_name}})
         raise HTTPException(status_code=500, detail=f"Error renaming item: {str(e)}")
 
+# --- Batched metadata calls ---
+DRIVE_BATCH_MAX_CALLS = 50 # Drive accepts 100 per batch, but larger batches trip per-user rate limits (rateLimitExceeded)
+
+def _build_batch_call(service, call: BatchCall):
+    if call.op == "get":
+        return service.files().get(fileId=call.fileId, fields=call.fields or "id, name, mimeType")
+    if call.op == "delete":
+        return delete_file_request(service, call.fileId)
+    return rename_file_request(service, call.fileId, call.name)
+
+def run_drive_batch(service, calls: list[BatchCall]) -> list[BatchCallResult]:
+    """Send the calls to Drive as batch HTTP requests of up to DRIVE_BATCH_MAX_CALLS each (blocking); media upload/download cannot be batched."""
+    results: list[BatchCallResult | None] = [None] * len(calls)
+
+    def on_response(request_id, response, exception):
+        index = int(request_id)
+        if exception is None:
+            results[index] = BatchCallResult(fileId=calls[index].fileId, ok=True, data=response or None)
+        elif isinstance(exception, HttpError):
+            results[index] = BatchCallResult(fileId=calls[index].fileId, ok=False, status=exception.resp.status, error=exception._get_reason())
+        else:
+            results[index] = BatchCallResult(fileId=calls[index].fileId, ok=False, status=500, error=str(exception))
+
+    http = None if USE_MOCK_DRIVE else thread_authorized_http(service._http.credentials)
+    for start in range(0, len(calls), DRIVE_BATCH_MAX_CALLS):
+        batch = service.new_batch_http_request(callback=on_response)
+        for index in range(start, min(start + DRIVE_BATCH_MAX_CALLS, len(calls))):
+            batch.add(_build_batch_call(service, calls[index]), request_id=str(index))
+        batch.execute(http=http)
+    return results
+
+@app.post("/api/drive/batch", response_model=BatchResponse, summary="Batch File Metadata Calls", tags=["Drive Operations"])
+async def batch_drive_calls(request: FastAPIRequest, batch_request: BatchRequest):
+    calls = batch_request.calls
+    logger.info("Running batch of %d Drive calls", len(calls), extra={"props": {"call_count": len(calls)}})
+    for call in calls:
+        if call.op == "rename" and not call.name:
+            raise HTTPException(status_code=422, detail=f"'rename' of {call.fileId} requires 'name'.")
+    service = await drive_service_for(request)
+    try:
+        results = await run_drive_call(run_drive_batch, service, calls) # One HTTPS round-trip per DRIVE_BATCH_MAX_CALLS calls
+    except HttpError as error:
+        _raise_from_http_error(error, "Running Drive batch", {"call_count": len(calls)})
+    except Exception as e:
+        logger.error(f"Unexpected error running Drive batch: {str(e)}", exc_info=True, extra={"props": {"call_count": len(calls)}})
+        raise HTTPException(status_code=500, detail=f"Error running batch: {str(e)}")
+    failed = sum(not result.ok for result in results)
+    logger.info("Drive batch finished: %d ok, %d failed", len(results) - failed, failed, extra={"props": {"call_count": len(calls), "failed_count": failed}})
+    if any(call.op != "get" for call in calls):
+        await invalidate_listings(request)
+    return BatchResponse(results=results)
+
 # --- Basic App Endpoints ---
 @app.get("/", response_model=MessageResponse, summary="Root Endpoint", tags=["General"])
 async def root():
@@ -397,8 +1075,32 @@ async def get_status_endpoint():
     logger.info("API status endpoint '/api/status' accessed.")
     return StatusResponse(status="Backend is running with Drive integration")
 
-# Redundant __init__.py check, should be handled by file creation in earlier step
-# if not os.path.exists(os.path.join(os.path.dirname(__file__), "__init__.py")):
-#     with open(os.path.join(os.path.dirname(__file__), "__init__.py"), "w") as f:
-#         f.write("# Automatically created by main.py\n")
-#         logger.info("Created backend/__init__.py as it was missing.")
+def worker_count() -> int:
+    """
+    Workers for the production launch. Several workers only work when they share state: the cookie signing key
+    (SESSION_SECRET) and the session/OAuth-state store (REDIS_URL), and not the in-process simulated Drive.
+    Without that, a login's callback lands on another worker and fails, so the default is one worker, and asking
+    for more refuses to start.
+    """
+    multi_worker_ready = config.SESSION_SECRET_IS_SHARED and session_store.shared and not USE_MOCK_DRIVE
+    requested = os.environ.get("WEB_CONCURRENCY")
+    if requested is None:
+        return 2 * (os.cpu_count() or 1) + 1 if multi_worker_ready else 1
+    workers = int(requested)
+    if workers > 1 and not multi_worker_ready:
+        raise SystemExit(f"WEB_CONCURRENCY={workers} needs SESSION_SECRET and REDIS_URL set (with the redis package installed) and real Drive credentials; sessions and simulated Drive state are otherwise per process.")
+    return workers
+
+if __name__ == "__main__":
+    # Production launch: python -m backend.main from the repository root (for development, uvicorn backend.main:app --reload)
+    import uvicorn
+    uvicorn.run(
+        "backend.main:app",
+        host=os.environ.get("HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+        workers=worker_count(),
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+        log_level="warning",
+    )
@@ -0,0 +1,107 @@
+# backend/sessions.py
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+
+from .cache import SHARED_LOCAL_CACHE_TTL_SECONDS, LocalTTLCache, redis_from_url
+
+try:
+    import orjson  # C codec for session payloads
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE_NAME = "drive_session"
+# Sessions are independent of the (hourly) access token, which is refreshed within the session. A session lapses
+# only after this long without use or on logout; every authenticated use extends it.
+SESSION_IDLE_TTL_SECONDS = 14 * 24 * 60 * 60
+# The cookie is issued once at login, so it outlives any realistic session; the server-side idle TTL decides when a
+# session ends. 400 days is the longest lifetime browsers accept.
+SESSION_COOKIE_MAX_AGE_SECONDS = 400 * 24 * 60 * 60
+OAUTH_STATE_TTL_SECONDS = 10 * 60  # A login has this long to come back through the callback
+LOCAL_CACHE_MAX_SESSIONS = 10_000
+
+
+def _dumps(data: dict) -> bytes:
+    return orjson.dumps(data) if orjson else json.dumps(data).encode()
+
+
+def _loads(raw: bytes) -> dict:
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def sign_session_id(session_id: str, secret: str) -> str:
+    """Cookie value for a session: the ID plus an HMAC, so clients cannot forge or guess other session IDs."""
+    signature = hmac.new(secret.encode(), session_id.encode(), hashlib.sha256).hexdigest()
+    return f"{session_id}.{signature}"
+
+
+def unsign_session_id(cookie_value: str | None, secret: str) -> str | None:
+    """Session ID from a cookie value, or None if it is missing or its signature does not match."""
+    if not cookie_value:
+        return None
+    session_id, _, signature = cookie_value.rpartition(".")
+    if not session_id:
+        return None
+    expected = hmac.new(secret.encode(), session_id.encode(), hashlib.sha256).hexdigest()
+    return session_id if hmac.compare_digest(signature, expected) else None
+
+
+class SessionStore:
+    """
+    Per-browser session data (credentials) and pending OAuth states.
+
+    Reads are served from an in-process LRU with a TTL. When a Redis URL is configured (and the redis
+    package is installed), Redis is the shared source of truth, so any worker can serve any session;
+    without it, sessions live only in this process. The TTL is an idle timeout: reads and writes extend it.
+    """
+
+    def __init__(self, redis_url: str | None = None, ttl: int = SESSION_IDLE_TTL_SECONDS, max_local: int = LOCAL_CACHE_MAX_SESSIONS):
+        self.ttl = ttl
+        self._redis = redis_from_url(redis_url)
+        self._local = LocalTTLCache(ttl if self._redis is None else min(ttl, SHARED_LOCAL_CACHE_TTL_SECONDS), max_local)
+        self._local_oauth_states = LocalTTLCache(OAUTH_STATE_TTL_SECONDS, max_local)  # Only used without Redis
+
+    @property
+    def shared(self) -> bool:
+        """True if sessions (and OAuth states) live in Redis, so every worker sees the same ones."""
+        return self._redis is not None
+
+    async def get(self, session_id: str, touch: bool = True) -> dict | None:
+        """Session data, or None. touch=False reads without counting as use (e.g. background token refresh)."""
+        data = self._local.get(session_id, extend=touch and self._redis is None)
+        if data is not None or self._redis is None:
+            return data
+        key = f"session:{session_id}"
+        raw = await (self._redis.getex(key, ex=self.ttl) if touch else self._redis.get(key))
+        if raw is None:
+            return None
+        data = _loads(raw)
+        self._local.set(session_id, data)
+        return data
+
+    async def set(self, session_id: str, data: dict):
+        self._local.set(session_id, data)
+        if self._redis is not None:
+            await self._redis.set(f"session:{session_id}", _dumps(data), ex=self.ttl)
+
+    async def set_oauth_state(self, session_id: str, state: str):
+        """Remember the CSRF state of a login in progress; it expires if the callback never comes."""
+        if self._redis is not None:
+            await self._redis.set(f"oauth_state:{session_id}", state, ex=OAUTH_STATE_TTL_SECONDS)
+        else:
+            self._local_oauth_states.set(session_id, state)
+
+    async def pop_oauth_state(self, session_id: str) -> str | None:
+        """Consume a login's CSRF state. Atomic (GETDEL) with Redis, so a replayed callback on another worker fails."""
+        if self._redis is None:
+            return self._local_oauth_states.pop(session_id)
+        raw = await self._redis.getdel(f"oauth_state:{session_id}")
+        return raw.decode() if raw is not None else None
@@ -0,0 +1,19 @@
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def assistant(monkeypatch, tmp_path):
+    """A freshly imported AI_CodeAsst whose config and session dirs live under a temporary HOME."""
+    monkeypatch.setenv("HOME", str(tmp_path))  # CONFIG_DIR is derived from the home directory at import
+    monkeypatch.syspath_prepend(str(REPO_ROOT))
+    monkeypatch.delitem(sys.modules, "AI_CodeAsst", raising=False)
+    module = importlib.import_module("AI_CodeAsst")
+    monkeypatch.setattr(module, "conversation_history", [])
+    yield module
+    sys.modules.pop("AI_CodeAsst", None)
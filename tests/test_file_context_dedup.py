@@ -0,0 +1,33 @@
+"""Cross-file dedup of file contexts in AI_CodeAsst must survive a session save/load round trip."""
+SHARED = "\n".join(f"shared_value_{i} = {i * i}  # common helper line {i}" for i in range(200))
+POINTER_MARKER = "# <duplicated from"
+
+
+def _context_text(assistant, path):
+    return assistant.file_context_index[path]["content"]
+
+
+def test_pointer_reexpanded_after_owner_removed(assistant):
+    assistant.append_file_context("/ws/a.py", "import os\n" + SHARED)
+    assistant.append_file_context("/ws/b.py", "import sys\n" + SHARED)
+    assert POINTER_MARKER in _context_text(assistant, "/ws/b.py")
+
+    assistant.remove_file_from_context("/ws/a.py", quiet=True)
+    assert POINTER_MARKER not in _context_text(assistant, "/ws/b.py")
+    assert SHARED in _context_text(assistant, "/ws/b.py")
+
+
+def test_pointer_reexpanded_after_save_load_and_owner_removed(assistant, monkeypatch):
+    assistant.append_file_context("/ws/a.py", "import os\n" + SHARED)
+    assistant.append_file_context("/ws/b.py", "import sys\n" + SHARED)
+    assistant.save_session("dedup_roundtrip")
+
+    history, _meta = assistant.load_session("dedup_roundtrip")
+    monkeypatch.setattr(assistant, "conversation_history", history)  # As /load_session does
+    assistant.reset_file_context_index()
+    assistant.rebuild_file_context_index()
+    assert POINTER_MARKER in _context_text(assistant, "/ws/b.py")
+
+    assistant.remove_file_from_context("/ws/a.py", quiet=True)
+    assert POINTER_MARKER not in _context_text(assistant, "/ws/b.py")
+    assert SHARED in _context_text(assistant, "/ws/b.py")